@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+Run a JSONL file of prompts through ChatBot without the Streamlit app.
+
+Each input line is a JSON object with either a "prompt" string or a list of chat
+"messages", and optionally an "id", a "system" prompt and a "temperature". Every
+prompt is answered independently, without chat history.
+
+Results are appended to the output JSONL as they complete, one object per input line
+with its "line" number, "id", "response" and "latency" (or "error"). Running again with
+the same output file skips the lines that already succeeded, so an interrupted batch
+resumes where it stopped.
+
+Usage:
+    python batch_runner.py prompts.jsonl results.jsonl --concurrency 16 --model gpt-4o
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from chatbot import ChatBot
+from clients import run_sync
+from instrumentation import get_instrumentation, quantile
+from logger import get_logger
+from rate_limiter import request_priority
+from response_cache import get_response_cache
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_SYSTEM_PROMPT = "You are an AI assistant. Follow the user's requirements carefully and to the letter."
+
+log = get_logger(__name__)
+
+
+def completed_lines(output_path: str) -> set[int]:
+    """
+    Return the input line numbers that already have a successful result in the output file.
+
+    Args:
+        output_path (str): The output JSONL file, which may not exist yet.
+
+    Returns:
+        set: The line numbers to skip.
+    """
+    done = set()
+    try:
+        with open(output_path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # the last line may be cut short by a crash
+                    continue
+                if "error" not in result:
+                    done.add(result["line"])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def build_messages(request: dict, system_prompt: str) -> list[dict]:
+    """
+    Build the chat messages for one input line.
+
+    Args:
+        request (dict): The parsed input line.
+        system_prompt (str): The system prompt used when the line has none.
+
+    Returns:
+        list: The messages to send.
+
+    Raises:
+        ValueError: If the line has neither "prompt" nor "messages".
+    """
+    if "messages" in request:
+        return request["messages"]
+    if "prompt" not in request:
+        raise ValueError("Each line needs a \"prompt\" or \"messages\".")
+    return [{"role": "system", "content": request.get("system", system_prompt)},
+            {"role": "user", "content": request["prompt"]}]
+
+
+async def run_batch(chatbot: ChatBot, input_path: str, output_path: str, concurrency: int,
+                    temperature: float, system_prompt: str = BATCH_SYSTEM_PROMPT) -> dict:
+    """
+    Answer every pending line of the input file with at most `concurrency` requests in flight.
+
+    Must run on the shared event loop (see clients.run_sync).
+
+    Args:
+        chatbot (ChatBot): The chatbot whose model and clients are used.
+        input_path (str): The input JSONL file.
+        output_path (str): The output JSONL file, appended to.
+        concurrency (int): The most requests in flight at once.
+        temperature (float): The default temperature, overridden per line by "temperature".
+        system_prompt (str): The system prompt for lines that have none.
+
+    Returns:
+        dict: The counts of completed, failed and skipped lines and the latency of each completed one.
+    """
+    done = completed_lines(output_path)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"completed": 0, "failed": 0, "skipped": 0, "latencies": []}
+    tasks = set()
+
+    with open(input_path) as src, open(output_path, "a") as out:
+        async def answer(number: int, request: dict) -> None:
+            start = time.perf_counter()
+            result = {"line": number}
+            try:
+                result["id"] = request.get("id")
+                messages = build_messages(request, system_prompt)
+                result["response"] = await chatbot.acomplete(messages, request.get("temperature", temperature))
+                result["latency"] = time.perf_counter() - start
+                stats["completed"] += 1
+                stats["latencies"].append(result["latency"])
+            except Exception as e:
+                # one failed prompt is reported and retried on the next run, the batch goes on
+                result["error"] = f"{type(e).__name__}: {e}"
+                stats["failed"] += 1
+                log.warning(f"Line {number} failed: {result['error']}")
+            finally:
+                semaphore.release()
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+
+        for number, line in enumerate(src):
+            if not line.strip():
+                continue
+            if number in done:
+                stats["skipped"] += 1
+                continue
+            # lines are read only as fast as requests finish, so the input can be any size
+            await semaphore.acquire()
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError(f"expected an object, got {type(request).__name__}")
+            except ValueError as e:
+                semaphore.release()
+                out.write(json.dumps({"line": number, "error": f"Invalid JSON: {e}"}) + "\n")
+                stats["failed"] += 1
+                continue
+            task = asyncio.create_task(answer(number, request))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="the JSONL file of prompts")
+    parser.add_argument("output", help="the JSONL file results are appended to")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="requests in flight at once")
+    parser.add_argument("--model", default="gpt-4o", help="the GPT engine to use")
+    parser.add_argument("--temperature", type=float, default=0.0,
+                        help="the default temperature; at 0 responses are served from the response cache if present")
+    parser.add_argument("--system", default=BATCH_SYSTEM_PROMPT, help="the system prompt for lines without one")
+    args = parser.parse_args()
+
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    if not openai_api_key:
+        sys.exit("Set OPENAI_API_KEY in the environment.")
+
+    chatbot = ChatBot(openai_api_key, args.model, get_response_cache())
+    start = time.perf_counter()
+    # batch requests yield to interactive and agent requests of the same key in this process
+    with request_priority("batch"):
+        stats = run_sync(run_batch(chatbot, args.input, args.output, args.concurrency, args.temperature,
+                                   args.system))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(stats["latencies"])
+    llm_rows = [row for row in get_instrumentation().summary() if row["kind"] == "llm"]
+    tokens = sum(row["prompt_tokens"] + row["completion_tokens"] for row in llm_rows)
+    prompt_tokens = sum(row["prompt_tokens"] for row in llm_rows)
+    cached_tokens = sum(row["cached_tokens"] for row in llm_rows)
+    print(f"completed: {stats['completed']}  failed: {stats['failed']}  skipped: {stats['skipped']}")
+    print(f"wall time: {wall:.1f}s  throughput: {stats['completed'] / wall if wall else 0:.2f} prompts/s  "
+          f"tokens: {tokens}  prompt cache: {cached_tokens / prompt_tokens if prompt_tokens else 0:.0%}")
+    print(f"latency p50: {quantile(latencies, 0.5):.2f}s  p90: {quantile(latencies, 0.9):.2f}s  "
+          f"p99: {quantile(latencies, 0.99):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import json
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, Callable
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from chatbot import ChatBot
+from context_window import message_tokens
+from tokenizer import count_tokens
+
+STREAM_CHUNK_CHARS = 16
+
+Script = Callable[[list[dict[str, Any]]], str]
+
+
+class ScriptedModel:
+    """
+    Stands in for the OpenAI client, answering chat completions from a script.
+
+    The script is either a list of responses returned in order or a callable that
+    receives the messages and returns the response. Calls and tokens are counted
+    locally, and the same object also provides the async client interface.
+    """
+
+    def __init__(self, script: Script | list[str], model: str = "gpt-4o") -> None:
+        self.script = script
+        self.model = model
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self._acreate)))
+
+    @classmethod
+    def from_recording(cls, path: str, model: str = "gpt-4o") -> "ScriptedModel":
+        """Replay the responses saved by a RecordingModel, in order."""
+        with open(path) as f:
+            return cls([json.loads(line)["response"] for line in f if line.strip()], model)
+
+    def reply(self, messages: list[dict[str, Any]]) -> str:
+        if callable(self.script):
+            return self.script(messages)
+        if self.calls > len(self.script):
+            raise ValueError(f"The script has only {len(self.script)} responses.")
+        return self.script[self.calls - 1]
+
+    def _create(self, model: str, messages: list[dict[str, Any]], stream: bool = False,
+                tools: list[dict[str, Any]] | None = None, **kwargs):
+        self.calls += 1
+        text = self.reply(messages)
+        prompt_tokens = sum(message_tokens(m, model) for m in messages)
+        if tools:
+            # tool definitions are sent with every request, so they count towards the prompt
+            prompt_tokens += count_tokens(json.dumps(tools), model)
+        completion_tokens = count_tokens(text, model)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if stream:
+            stream_options = (kwargs.get("extra_body") or {}).get("stream_options") or {}
+            return _ScriptedStream(model, text, usage if stream_options.get("include_usage") else None)
+        message = _tool_call_message(text) if tools else {"role": "assistant", "content": text}
+        return ChatCompletion.model_validate({
+            "id": f"scripted-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": model, "usage": usage,
+            "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None, "message": message}],
+        })
+
+    async def _acreate(self, **kwargs):
+        return self._create(**kwargs)
+
+
+def _tool_call_message(text: str) -> dict[str, Any]:
+    """Turn a scripted ReAct JSON response into the equivalent tool call, or keep it as text."""
+    try:
+        response = json.loads(text)
+        actions = [dict(action) for action in response["actions"]]
+        names = [action.pop("type") for action in actions]
+    except (ValueError, KeyError, TypeError):
+        return {"role": "assistant", "content": text}
+    thought = response.get("thought", "")
+    return {"role": "assistant", "content": None, "tool_calls": [
+        {"id": f"call_{uuid.uuid4().hex}", "type": "function",
+         "function": {"name": name, "arguments": json.dumps({"thought": thought, **action})}}
+        for name, action in zip(names, actions)
+    ]}
+
+
+class _ScriptedStream:
+    def __init__(self, model: str, text: str, usage: dict[str, int] | None) -> None:
+        self.closed = False
+        self._chunks = [
+            ChatCompletionChunk.model_validate({
+                "id": "scripted", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": None, "delta": {"content": text[i:i + STREAM_CHUNK_CHARS]}}],
+            })
+            for i in range(0, len(text), STREAM_CHUNK_CHARS)
+        ]
+        if usage is not None:
+            # like the API with stream_options.include_usage: a last chunk with no choices
+            self._chunks.append(ChatCompletionChunk.model_validate({
+                "id": "scripted", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [], "usage": usage,
+            }))
+        self.usage = usage
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            if self.closed:
+                return
+            yield chunk
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class RecordingModel:
+    """
+    Wraps a real OpenAI client and saves every response to a JSONL file for later replay.
+    """
+
+    def __init__(self, client, path: str) -> None:
+        self.client = client
+        self.path = path
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, stream: bool = False, **kwargs):
+        response = self.client.chat.completions.create(stream=stream, **kwargs)
+        if not stream:
+            self._save(response.choices[0].message.content)
+            return response
+        return self._record_stream(response)
+
+    def _record_stream(self, response):
+        parts = []
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                yield chunk
+        finally:
+            self._save("".join(parts))
+
+    def _save(self, text: str) -> None:
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"response": text}) + "\n")
+
+
+def scripted_chatbot(model: ScriptedModel) -> ChatBot:
+    """Return a ChatBot whose completions are answered by `model` instead of the API."""
+    chatbot = ChatBot("scripted", model.model)
+    chatbot.client = model
+    chatbot.async_client = model.async_client
+    return chatbot
+
+
+class CountingToolkit:
+    """Forwards to a TodoistActionToolKit while counting the calls to its public methods."""
+
+    def __init__(self, toolkit) -> None:
+        self._toolkit = toolkit
+        self.calls: dict[str, int] = {}
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._toolkit, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+def run_agent(objective: str, agent: ScriptedModel, repair: ScriptedModel, toolkit,
+              max_actions: int = 50, hist_len: int = 50, tool_calling: bool = False) -> dict[str, Any]:
+    """
+    Run todoist_agent_loop once with scripted models and collect its costs.
+
+    Returns:
+        dict: LLM and repair calls, prompt and completion tokens, tool calls, wall time
+        and the messages the loop rendered.
+    """
+    # imported here so the harness module stays importable without the Streamlit app
+    from main import todoist_agent_loop
+
+    rendered = []
+    counting_toolkit = CountingToolkit(toolkit)
+    start = time.perf_counter()
+    todoist_agent_loop(scripted_chatbot(agent), objective, 0.0, hist_len, max_actions, None,
+                       toolkit=counting_toolkit, repair_chatbot=scripted_chatbot(repair),
+                       render=rendered.append, live=False, tool_calling=tool_calling)
+    return {
+        "llm_calls": agent.calls,
+        "repair_calls": repair.calls,
+        "prompt_tokens": agent.prompt_tokens + repair.prompt_tokens,
+        "completion_tokens": agent.completion_tokens + repair.completion_tokens,
+        "tool_calls": sum(counting_toolkit.calls.values()),
+        "wall_seconds": time.perf_counter() - start,
+        "rendered": rendered,
+    }
@@ -0,0 +1,196 @@
+import json
+import re
+from typing import Any, Callable
+
+from todoist_agent.observations import decode_rows
+
+BULK_MOVE_SIZE = 50
+
+
+def _last_observation(messages: list[dict[str, Any]]) -> list[Any] | None:
+    """Return the results of the actions in the last observation, or None before the first one."""
+    for message in reversed(messages):
+        if message["role"] != "user":
+            continue
+        try:
+            observation = json.loads(message["content"]).get("observation")
+        except ValueError:
+            return None
+        if not isinstance(observation, list):
+            return None
+        return [_decode(entry.get("result")) for entry in observation]
+    return None
+
+
+def _decode(result: Any) -> Any:
+    if isinstance(result, dict) and "rows" in result:
+        return decode_rows(result)
+    return result
+
+
+def _reply(thought: str, *actions: dict[str, Any]) -> str:
+    return json.dumps({"thought": thought, "actions": list(actions)})
+
+
+class SortInboxPolicy:
+    """
+    Plays an agent that reads the projects and inbox, then spreads the inbox tasks over the projects.
+
+    With `plan` the agent batches its actions: both reads in one turn, then every move in one turn.
+    """
+
+    def __init__(self, bulk: bool = True, limit: int | None = None, plan: bool = False) -> None:
+        self.bulk = bulk
+        self.limit = limit
+        self.plan = plan
+        self.state = "start"
+        self.projects: list[str] = []
+        self.pending: list[str] = []
+        self.moves = 0
+
+    def __call__(self, messages: list[dict[str, Any]]) -> str:
+        observation = _last_observation(messages)
+        if self.state == "start" and self.plan:
+            self.state = "planned"
+            return _reply("I need the projects and the inbox.",
+                          {"type": "get_all_projects"}, {"type": "get_all_inbox_tasks"})
+        if self.state == "planned":
+            projects, inbox = observation
+            self._read_projects(projects)
+            self._read_inbox(inbox)
+        if self.state == "start":
+            self.state = "projects"
+            return _reply("I need to know the projects first.", {"type": "get_all_projects"})
+        if self.state == "projects":
+            self._read_projects(observation[0])
+            self.state = "inbox"
+            return _reply("Now I need the inbox tasks.", {"type": "get_all_inbox_tasks"})
+        if self.state == "inbox":
+            self._read_inbox(observation[0])
+
+        if self.pending:
+            if self.plan:
+                moves = []
+                while self.pending:
+                    moves.append(self._next_move())
+                return _reply("Moving all inbox tasks.", *moves)
+            return _reply("Moving the next tasks.", self._next_move())
+
+        return _reply("All inbox tasks are sorted.", {"type": "give_final_answer", "answer": "Your inbox is sorted."})
+
+    def _read_projects(self, projects: list[dict[str, Any]]) -> None:
+        self.projects = [p["project_id"] for p in projects if not p["is_inbox"]]
+
+    def _read_inbox(self, tasks: list[dict[str, Any]]) -> None:
+        self.pending = [t["task_id"] for t in tasks][:self.limit]
+        self.state = "moving"
+
+    def _next_move(self) -> dict[str, Any]:
+        project_id = self.projects[self.moves % len(self.projects)]
+        self.moves += 1
+        if self.bulk:
+            task_ids, self.pending = self.pending[:BULK_MOVE_SIZE], self.pending[BULK_MOVE_SIZE:]
+            return {"type": "move_tasks", "task_ids": task_ids, "project_id": project_id}
+        return {"type": "move_task", "task_id": self.pending.pop(0), "project_id": project_id}
+
+
+class CountProjectsPolicy:
+    """Plays an agent that answers a question from a single read."""
+
+    def __call__(self, messages: list[dict[str, Any]]) -> str:
+        observation = _last_observation(messages)
+        if observation is None:
+            return _reply("I need the projects.", {"type": "get_all_projects"})
+        return _reply("I counted the projects.",
+                      {"type": "give_final_answer", "answer": f"You have {len(observation[0])} projects."})
+
+
+class OldInboxTasksPolicy:
+    """Plays an agent that pages through the old inbox tasks with query_tasks instead of reading everything."""
+
+    def __init__(self, page_size: int = 20) -> None:
+        self.page_size = page_size
+        self.inbox_id = None
+        self.seen = 0
+
+    def __call__(self, messages: list[dict[str, Any]]) -> str:
+        observation = _last_observation(messages)
+        if observation is None:
+            return _reply("I need the inbox id.", {"type": "get_all_projects"})
+        if self.inbox_id is None:
+            self.inbox_id = next(p["project_id"] for p in observation[0] if p["is_inbox"])
+        else:
+            self.seen += len(observation[0])
+            if len(observation[0]) < self.page_size:
+                answer = f"{self.seen} inbox tasks are older than 180 days."
+                return _reply("I have seen every old inbox task.", {"type": "give_final_answer", "answer": answer})
+        return _reply("Fetching the next page of old inbox tasks.",
+                      {"type": "query_tasks", "project_id": self.inbox_id, "older_than_days": 180,
+                       "limit": self.page_size, "offset": self.seen})
+
+
+class CreateProjectPolicy:
+    """Plays an agent that creates one project."""
+
+    def __call__(self, messages: list[dict[str, Any]]) -> str:
+        observation = _last_observation(messages)
+        if observation is None:
+            return _reply("I will create the project.", {"type": "create_new_project", "project_name": "Groceries"})
+        return _reply("The project exists now.", {"type": "give_final_answer", "answer": "Created Groceries."})
+
+
+class SloppyJsonPolicy:
+    """Wraps a policy so every response is fenced markdown with single-quoted JSON."""
+
+    def __init__(self, policy: Callable[[list[dict[str, Any]]], str]) -> None:
+        self.policy = policy
+
+    def __call__(self, messages: list[dict[str, Any]]) -> str:
+        return "```json\n" + self.policy(messages).replace('"', "'") + "\n```\nSorry for any confusion!"
+
+
+def repair_policy(messages: list[dict[str, Any]]) -> str:
+    """Plays the repair model: returns the faulty input with fences stripped and quotes fixed."""
+    prompt = messages[-1]["content"]
+    faulty = prompt.split("FAULTY_INPUT:\n", 1)[1].split("\n\nERROR_MSG:", 1)[0]
+    match = re.search(r"\{.*\}", faulty, re.DOTALL)
+    return (match.group(0) if match else faulty).replace("'", '"')
+
+
+SCENARIOS = {
+    "sort-inbox-bulk": {
+        "objective": "Sort my inbox.",
+        "tasks": 500,
+        "agent": lambda: SortInboxPolicy(bulk=True),
+    },
+    "sort-inbox-planned": {
+        "objective": "Sort my inbox.",
+        "tasks": 500,
+        "agent": lambda: SortInboxPolicy(bulk=True, plan=True),
+    },
+    "sort-inbox-one-by-one": {
+        "objective": "Sort the first 20 tasks of my inbox.",
+        "tasks": 500,
+        "agent": lambda: SortInboxPolicy(bulk=False, limit=20),
+    },
+    "old-inbox-tasks-paged": {
+        "objective": "How many inbox tasks are older than half a year?",
+        "tasks": 500,
+        "agent": OldInboxTasksPolicy,
+    },
+    "count-projects": {
+        "objective": "How many projects do I have?",
+        "tasks": 100,
+        "agent": CountProjectsPolicy,
+    },
+    "create-project": {
+        "objective": "Create a project for groceries.",
+        "tasks": 100,
+        "agent": CreateProjectPolicy,
+    },
+    "count-projects-sloppy-json": {
+        "objective": "How many projects do I have?",
+        "tasks": 100,
+        "agent": lambda: SloppyJsonPolicy(CountProjectsPolicy()),
+    },
+}
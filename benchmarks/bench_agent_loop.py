@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Run todoist_agent_loop over a corpus of objectives with scripted models and a local
+fake Todoist service, and report LLM calls, repair calls, tokens, tool calls and wall time.
+
+Run it from the repository root with `python -m benchmarks.bench_agent_loop`.
+"""
+import argparse
+import json
+import uuid
+
+from benchmarks.agent_harness import ScriptedModel, run_agent
+from benchmarks.agent_scenarios import SCENARIOS, repair_policy
+from benchmarks.fake_todoist import FakeTodoistAccount, FakeTodoistServer
+from todoist_agent.todoist_action_toolkit import TodoistActionToolKit
+
+COLUMNS = ("llm_calls", "repair_calls", "prompt_tokens", "completion_tokens", "tool_calls")
+
+
+def run_scenario(name: str, model: str, recording: str | None = None, mode: str = "prompt") -> dict:
+    scenario = SCENARIOS[name]
+    if recording:
+        agent = ScriptedModel.from_recording(recording, model)
+    else:
+        agent = ScriptedModel(scenario["agent"](), model)
+    repair = ScriptedModel(repair_policy, model)
+
+    with FakeTodoistServer(FakeTodoistAccount.seed(scenario["tasks"])):
+        toolkit = TodoistActionToolKit(f"benchmark-{uuid.uuid4().hex}")
+        try:
+            result = run_agent(scenario["objective"], agent, repair, toolkit, tool_calling=mode == "tools")
+        finally:
+            toolkit.replica.path.unlink(missing_ok=True)
+    return {"scenario": name, "mode": mode, **result}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--model", default="gpt-4o", help="model name used for token counting")
+    parser.add_argument("--recording", help="replay agent responses saved by RecordingModel instead of the script")
+    parser.add_argument("--modes", nargs="+", choices=("prompt", "tools"), default=["prompt", "tools"],
+                        help="JSON in the prompt, native tool calling, or both")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'scenario':<28} {'mode':<7} " + " ".join(f"{column:>17}" for column in COLUMNS) + f" {'seconds':>8}")
+    for name in args.scenarios:
+        for mode in args.modes:
+            result = run_scenario(name, args.model, args.recording, mode)
+            results.append(result)
+            print(f"{name:<28} {mode:<7} " + " ".join(f"{result[column]:>17}" for column in COLUMNS) +
+                  f" {result['wall_seconds']:>8.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Measure the cold start of the Streamlit app: how long importing main.py takes, which
+heavy libraries it pulls in, and how long the first render and a rerun take.
+
+Every measurement runs in a fresh interpreter. Run it from the repository root with
+`python -m benchmarks.bench_startup`.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# libraries that should only be imported once they are needed
+HEAVY_MODULES = ("fitz", "docx", "pptx", "streamlit_chat", "todoist_api_python", "tiktoken")
+
+IMPORT_PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+print(json.dumps({{"seconds": time.perf_counter() - start,
+                  "heavy": [name for name in {HEAVY_MODULES!r} if name in sys.modules]}}))
+"""
+
+RENDER_PROBE = """
+import json, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+app = AppTest.from_file("main.py", default_timeout=120)
+app.run()
+first = time.perf_counter() - start
+if app.exception:
+    raise SystemExit(str(app.exception))
+start = time.perf_counter()
+app.run()
+print(json.dumps({"first_render_seconds": first, "rerun_seconds": time.perf_counter() - start}))
+"""
+
+
+def _probe(code: str) -> dict:
+    # the app builds OpenAI clients on its first render, which needs some key
+    env = {"OPENAI_API_KEY": "benchmark", **os.environ}
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=False)
+    if result.returncode != 0:
+        raise RuntimeError(f"Probe failed:\n{result.stderr or result.stdout}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list[tuple[str, float]]:
+    """Return the `top` modules with the largest cumulative import time when importing main."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            capture_output=True, text=True, check=False)
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(timings, key=lambda timing: timing[1], reverse=True)[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=10, help="how many of the slowest imports to list")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    imports = [_probe(IMPORT_PROBE) for _ in range(args.runs)]
+    renders = [_probe(RENDER_PROBE) for _ in range(args.runs)]
+    results = {
+        "import_seconds": statistics.median(run["seconds"] for run in imports),
+        "heavy_modules_at_import": imports[0]["heavy"],
+        "first_render_seconds": statistics.median(run["first_render_seconds"] for run in renders),
+        "rerun_seconds": statistics.median(run["rerun_seconds"] for run in renders),
+        "slowest_imports": slowest_imports(args.top),
+    }
+
+    print(f"import main:       {results['import_seconds']:.3f}s (median of {args.runs})")
+    print(f"heavy modules:     {', '.join(results['heavy_modules_at_import']) or 'none'}")
+    print(f"first render:      {results['first_render_seconds']:.3f}s")
+    print(f"rerun:             {results['rerun_seconds']:.3f}s")
+    print("slowest imports (cumulative):")
+    for name, seconds in results["slowest_imports"]:
+        print(f"  {seconds:7.3f}s  {name}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Measure HTTP calls, bytes transferred and wall-clock time per TodoistActionToolKit method
+against a local fake Todoist service, for synthetic accounts of increasing size.
+
+Run it from the repository root with `python -m benchmarks.bench_todoist_toolkit`.
+"""
+import argparse
+import json
+import uuid
+
+from benchmarks.fake_todoist import FakeTodoistAccount, FakeTodoistServer
+from benchmarks.http_accounting import HttpAccounting
+from todoist_agent.todoist_action_toolkit import TodoistActionToolKit
+from todoist_agent.todoist_sync import get_session
+
+DEFAULT_SIZES = (10, 1000, 10000, 100000)
+BULK_MOVE_SIZE = 50
+
+
+def run(size: int) -> list[dict]:
+    account = FakeTodoistAccount.seed(size)
+    # a fresh key per run gives the toolkit an empty replica
+    api_key = f"benchmark-{uuid.uuid4().hex}"
+    results = []
+    with FakeTodoistServer(account), HttpAccounting(get_session()) as accounting:
+        toolkit = TodoistActionToolKit(api_key)
+        try:
+            with accounting.measure("get_all_tasks (cold)"):
+                toolkit.get_all_tasks()
+            with accounting.measure("get_inbox_tasks"):
+                inbox_tasks = toolkit.get_inbox_tasks()
+            target = next(p["project_id"] for p in toolkit.get_all_projects() if not p["is_inbox"])
+            if inbox_tasks:
+                with accounting.measure("move_task"):
+                    toolkit.move_task(inbox_tasks[0]["task_id"], target)
+            bulk = [task["task_id"] for task in inbox_tasks[1:1 + BULK_MOVE_SIZE]]
+            if bulk:
+                with accounting.measure(f"move_tasks ({len(bulk)})"):
+                    toolkit.move_tasks(bulk, target)
+            with accounting.measure("create_project"):
+                toolkit.create_project(f"Benchmark {uuid.uuid4().hex[:8]}")
+            with accounting.measure("get_all_tasks (warm start)"):
+                TodoistActionToolKit(api_key).get_all_tasks()
+        finally:
+            toolkit.replica.path.unlink(missing_ok=True)
+
+        for method, result in accounting.results.items():
+            results.append({"tasks": size, "method": method, **result})
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="tasks per synthetic account")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'tasks':>7} {'method':<28} {'calls':>5} {'sent':>10} {'received':>12} {'seconds':>8}")
+    for size in args.sizes:
+        for row in run(size):
+            results.append(row)
+            print(f"{row['tasks']:>7} {row['method']:<28} {row['calls']:>5} {row['bytes_sent']:>10} "
+                  f"{row['bytes_received']:>12} {row['seconds']:>8.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import json
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlparse
+
+from todoist_agent import todoist_sync
+from todoist_agent.todoist_sync import RateLimitedAdapter, get_session
+
+TODOIST_BASE_URL = "https://api.todoist.com"
+TASK_WORDS = ("buy", "call", "email", "fix", "plan", "review", "write", "book", "clean", "read")
+
+
+class FakeTodoistAccount:
+    """
+    The state of one synthetic Todoist account.
+
+    Every change bumps a version number that doubles as the sync token, so incremental
+    syncs return exactly the projects and items changed since the token was issued.
+    """
+
+    def __init__(self) -> None:
+        self.version = 0
+        self.projects: dict[str, dict[str, Any]] = {}
+        self.items: dict[str, dict[str, Any]] = {}
+        self._next_id = 1000
+        self._lock = threading.Lock()
+        self.inbox_id = self.add_project("Inbox", inbox=True)["id"]
+
+    @classmethod
+    def seed(cls, task_count: int, project_count: int | None = None, inbox_share: float = 0.3,
+             rng_seed: int = 0) -> "FakeTodoistAccount":
+        """Create an account with `task_count` tasks spread over the inbox and `project_count` projects."""
+        rng = random.Random(rng_seed)
+        account = cls()
+        project_count = project_count or max(3, task_count // 50)
+        project_ids = [account.add_project(f"Project {i}")["id"] for i in range(project_count)]
+        now = datetime.now(timezone.utc)
+        for i in range(task_count):
+            project_id = account.inbox_id if rng.random() < inbox_share else rng.choice(project_ids)
+            content = f"{rng.choice(TASK_WORDS)} {rng.choice(TASK_WORDS)} #{i}"
+            added_at = now - timedelta(minutes=rng.randrange(60 * 24 * 365))
+            account.add_item(content, project_id, added_at)
+        return account
+
+    def _new_id(self) -> str:
+        self._next_id += 1
+        return str(self._next_id)
+
+    def _touch(self, resource: dict[str, Any]) -> None:
+        self.version += 1
+        resource["_version"] = self.version
+
+    def add_project(self, name: str, inbox: bool = False) -> dict[str, Any]:
+        with self._lock:
+            project = {"id": self._new_id(), "name": name, "inbox_project": inbox,
+                       "parent_id": None, "is_deleted": False, "is_archived": False}
+            self._touch(project)
+            self.projects[project["id"]] = project
+            return project
+
+    def add_item(self, content: str, project_id: str, added_at: datetime) -> dict[str, Any]:
+        with self._lock:
+            item = {"id": self._new_id(), "content": content, "project_id": project_id,
+                    "added_at": added_at.isoformat().replace("+00:00", "Z"),
+                    "checked": False, "is_deleted": False}
+            self._touch(item)
+            self.items[item["id"]] = item
+            return item
+
+    def move_item(self, item_id: str, project_id: str) -> None:
+        with self._lock:
+            item = self.items.get(item_id)
+            if item is None or item["is_deleted"]:
+                raise KeyError(f"Item {item_id} not found")
+            if project_id not in self.projects or self.projects[project_id]["is_deleted"]:
+                raise KeyError(f"Project {project_id} not found")
+            item["project_id"] = project_id
+            self._touch(item)
+
+    def delete_project(self, project_id: str) -> None:
+        with self._lock:
+            project = self.projects.get(project_id)
+            if project is None or project["is_deleted"]:
+                raise KeyError(f"Project {project_id} not found")
+            project["is_deleted"] = True
+            self._touch(project)
+            for item in self.items.values():
+                if item["project_id"] == project_id and not item["is_deleted"]:
+                    item["is_deleted"] = True
+                    self._touch(item)
+
+    def sync(self, sync_token: str) -> dict[str, Any]:
+        with self._lock:
+            full_sync = sync_token == "*"
+            since = 0 if full_sync else int(sync_token)
+            projects = [_public(p) for p in self.projects.values()
+                        if p["_version"] > since and not (full_sync and p["is_deleted"])]
+            items = [_public(i) for i in self.items.values()
+                     if i["_version"] > since and not (full_sync and i["is_deleted"])]
+            return {"full_sync": full_sync, "sync_token": str(self.version), "projects": projects, "items": items}
+
+    def rest_projects(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [_rest_project(p) for p in self.projects.values() if not p["is_deleted"]]
+
+    def rest_tasks(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [_rest_task(i) for i in self.items.values() if not i["is_deleted"] and not i["checked"]]
+
+
+def _public(resource: dict[str, Any]) -> dict[str, Any]:
+    return {key: value for key, value in resource.items() if not key.startswith("_")}
+
+
+def _rest_project(project: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "id": project["id"], "name": project["name"], "is_inbox_project": project["inbox_project"],
+        "parent_id": project["parent_id"], "color": "grey", "comment_count": 0, "is_favorite": False,
+        "is_shared": False, "is_team_inbox": False, "order": 0, "view_style": "list",
+        "url": f"https://todoist.com/showProject?id={project['id']}",
+    }
+
+
+def _rest_task(item: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "id": item["id"], "content": item["content"], "project_id": item["project_id"],
+        "created_at": item["added_at"], "comment_count": 0, "is_completed": False, "creator_id": "1",
+        "description": "", "due": None, "labels": [], "order": 0, "parent_id": None, "priority": 1,
+        "section_id": None, "url": f"https://todoist.com/showTask?id={item['id']}",
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    account: FakeTodoistAccount
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send(self, status: int, payload: Any = None) -> None:
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path
+        if path == "/rest/v2/projects":
+            self._send(200, self.account.rest_projects())
+        elif path == "/rest/v2/tasks":
+            self._send(200, self.account.rest_tasks())
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        path = urlparse(self.path).path
+        body = self._body()
+        if path == "/rest/v2/projects":
+            project = self.account.add_project(json.loads(body)["name"])
+            self._send(200, _rest_project(project))
+        elif path == "/sync/v9/sync":
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                self._send(200, self._run_commands(json.loads(body)["commands"]))
+            else:
+                form = parse_qs(body.decode())
+                self._send(200, self.account.sync(form.get("sync_token", ["*"])[0]))
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_DELETE(self) -> None:
+        path = urlparse(self.path).path
+        if path.startswith("/rest/v2/projects/"):
+            try:
+                self.account.delete_project(path.rsplit("/", 1)[1])
+                self._send(204)
+            except KeyError:
+                self._send(404, {"error": "not found"})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def _run_commands(self, commands: list[dict[str, Any]]) -> dict[str, Any]:
+        status = {}
+        for command in commands:
+            args = command["args"]
+            try:
+                if command["type"] == "item_move":
+                    self.account.move_item(args["id"], args["project_id"])
+                elif command["type"] == "project_delete":
+                    self.account.delete_project(args["id"])
+                else:
+                    raise KeyError(f"Unsupported command {command['type']}")
+                status[command["uuid"]] = "ok"
+            except KeyError as e:
+                status[command["uuid"]] = {"error": str(e), "error_code": 20, "http_code": 400}
+        return {"sync_status": status, "temp_id_mapping": {}, "sync_token": str(self.account.version)}
+
+
+class _RedirectAdapter(RateLimitedAdapter):
+    # rate limited like the real session, so benchmarks see the scheduler's waits
+    def __init__(self, base_url: str) -> None:
+        super().__init__()
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        request.url = request.url.replace(TODOIST_BASE_URL, self.base_url, 1)
+        return super().send(request, **kwargs)
+
+
+class FakeTodoistServer:
+    """
+    A local HTTP stand-in for the Todoist REST and Sync endpoints used by the toolkit.
+
+    `install` points the shared Todoist session and the Sync API URL at the server,
+    so TodoistActionToolKit and the reset script run against it unchanged, and
+    `uninstall` points them back when the server stops.
+    """
+
+    def __init__(self, account: FakeTodoistAccount, port: int = 0) -> None:
+        handler = type("Handler", (_Handler,), {"account": account})
+        self.account = account
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-todoist", daemon=True)
+        self._previous: tuple[Any, str] | None = None
+
+    def __enter__(self) -> "FakeTodoistServer":
+        self._thread.start()
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.uninstall()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def install(self) -> None:
+        session = get_session()
+        self._previous = (session.adapters.get(TODOIST_BASE_URL), todoist_sync.TODOIST_SYNC_URL)
+        session.mount(TODOIST_BASE_URL, _RedirectAdapter(self.base_url))
+        todoist_sync.TODOIST_SYNC_URL = f"{self.base_url}/sync/v9/sync"
+
+    def uninstall(self) -> None:
+        if self._previous is None:
+            return
+        session = get_session()
+        adapter, todoist_sync.TODOIST_SYNC_URL = self._previous
+        if adapter is None:
+            # requests to Todoist fall back to the session's https:// adapter again
+            del session.adapters[TODOIST_BASE_URL]
+        else:
+            session.mount(TODOIST_BASE_URL, adapter)
+        self._previous = None
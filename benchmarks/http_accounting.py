@@ -0,0 +1,45 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any
+
+import requests
+
+
+class HttpAccounting:
+    """
+    Counts the HTTP calls and bytes that go through a requests session, per labelled step.
+    """
+
+    def __init__(self, session: requests.Session) -> None:
+        self.session = session
+        self.results: dict[str, dict[str, Any]] = defaultdict(
+            lambda: {"calls": 0, "bytes_sent": 0, "bytes_received": 0, "seconds": 0.0})
+        self._label = None
+
+    def __enter__(self) -> "HttpAccounting":
+        self.session.hooks["response"].append(self._record)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.session.hooks["response"].remove(self._record)
+
+    @contextmanager
+    def measure(self, label: str):
+        """Attribute the HTTP calls and wall-clock time of the block to `label`."""
+        self._label = label
+        start = time.perf_counter()
+        try:
+            yield self.results[label]
+        finally:
+            self.results[label]["seconds"] += time.perf_counter() - start
+            self._label = None
+
+    def _record(self, response: requests.Response, *args, **kwargs) -> None:
+        if self._label is None:
+            return
+        result = self.results[self._label]
+        body = response.request.body or b""
+        result["calls"] += 1
+        result["bytes_sent"] += len(body.encode() if isinstance(body, str) else body)
+        result["bytes_received"] += len(response.content)
@@ -1,7 +1,26 @@
+import asyncio
+import json
+import os
+import time
 import pydantic
-from datetime import datetime
-from openai import OpenAI
+from openai.types import CompletionUsage
+from datetime import date
+from clients import get_async_openai_client, get_openai_client, run_sync
+from context_window import ConversationWindow, message_tokens
+from instrumentation import get_instrumentation
 from logger import get_logger
+from tokenizer import count_tokens
+
+# "auto" uses tool calling unless the engine lacks it; "tools" or "prompt" force one mode
+AGENT_MODE = os.getenv("AGENT_MODE", "auto")
+# engines without function calling, which get the JSON schema in the prompt instead
+PROMPT_ONLY_ENGINES = ("o1-preview", "o1-mini")
+
+SUMMARY_PROMPT = \
+    "Summarize the conversation below for your own future reference." + \
+    "\nFold it into the existing summary if there is one." + \
+    "\nKeep facts, decisions, names, numbers and open questions; drop pleasantries." + \
+    "\nRespond with the summary only."
 
 
 class ChatBot:
@@ -11,37 +30,57 @@ class ChatBot:
     Attributes:
         api_key (str): The API key for accessing the GPT service.
         gpt_engine_choice (str): The choice of GPT engine to use (default: "gpt-4-1106-preview").
-        client (OpenAI): The OpenAI client for making API requests.
+        client (OpenAI): The shared OpenAI client for making API requests.
+        async_client (AsyncOpenAI): The shared asynchronous OpenAI client.
         gpt_engine (str): The selected GPT engine.
         messages (list): The list of chat messages.
+        window (ConversationWindow): Selects the messages sent within the model's token budget.
+        response_cache (ResponseCache): The optional cache of completions, used at temperature 0 or on request.
         system_default (str): The default system prompt.
+        context (str): Document excerpts for the next request, sent after the history rather than in the system prompt.
+        dated (bool): Whether today's date is sent after the history, as it is for the general assistant.
 
     Methods:
-        __init__(self, api_key, gpt_engine_choice="gpt-4-1106-preview"): Initializes the ChatBot instance.
-        set_todoist_prompt(self, react_model: pydantic.BaseModel, question: str) -> str: Sets the prompt for a Todoist task.  # noqa
+        __init__(self, api_key, gpt_engine_choice="gpt-4-1106-preview", response_cache=None): Initializes the ChatBot instance.  # noqa
+        set_todoist_prompt(self, react_model: pydantic.BaseModel, question: str, tools=False) -> str: Sets the prompt for a Todoist task.  # noqa
+        supports_tools(self): Whether the agent should answer through tool calls.
         set_system_prompt(self, content_type, ext_prompt): Sets the system prompt based on the content type.
+        set_context(self, context): Sets the document excerpts sent with the next requests.
         send(self, role, content, temp, hist_len): Sends a message to the chatbot and receives a response.
+        asend(self, role, content, temp, hist_len): The asynchronous version of send.
+        acomplete(self, messages, temp): Completes a list of messages without touching the chat history.
+        complete_many(self, requests, temp): Completes several lists of messages concurrently.
+        stream(self, role, content, temp, hist_len): Sends a message and yields the response as it is generated.
+        call_tool(self, role, content, temp, hist_len, tools): Sends a message and returns the tools the model called.
         set_message_content(self, index, content): Sets the content of a message in the chat.
+        reset_history(self): Clears the chat history, keeping the system prompt.
+        fold(self, count): Folds the oldest turns of the chat history into the summary.
 
     '''
 
-    def __init__(self, api_key, gpt_engine_choice="gpt-4-1106-preview"):
+    def __init__(self, api_key, gpt_engine_choice="gpt-4-1106-preview", response_cache=None):
         '''
         Initializes a ChatBot instance.
 
         Args:
             api_key (str): The API key for accessing the GPT service.
             gpt_engine_choice (str): The choice of GPT engine to use (default: "gpt-4-1106-preview").
+            response_cache (ResponseCache): The cache of completions to use (default: None, no caching).
         '''
         log = get_logger(__name__)
         log.info(f"Init chatbot...{gpt_engine_choice}\n")
-        # get the key form the streamlit app
-        self.client = OpenAI(api_key=api_key)
+        # get the key form the streamlit app; clients are shared by every ChatBot in the process
+        self.client = get_openai_client(api_key)
+        self.async_client = get_async_openai_client(api_key)
         self.gpt_engine = gpt_engine_choice
         self.messages = ['']  # initialize the messages list
+        self.window = ConversationWindow()
+        self.response_cache = response_cache
+        self.context = ""
+        self.dated = False
+        # static, so every request starts with the same prefix; the date is sent after the history
         self.system_default = \
             "You are an AI assistant." + \
-            f"\nThe current date and time is: {datetime.now()}" + \
             "\nUnless otherwise specified, all responses should be in English." + \
             "\nUnless otherwise specified, all responses should be in the form of text." + \
             "\nUnless the user explicitly asks for code, do not provide code snippets." + \
@@ -61,31 +100,55 @@ class ChatBot:
             "\nFollow the user's requirements carefully & to the letter." + \
             "\nMinimize any other prose."
 
-    def set_todoist_prompt(self, react_model: pydantic.BaseModel, question: str) -> str:
+    def set_todoist_prompt(self, react_model: pydantic.BaseModel, question: str, tools=False) -> str:
         '''
         Sets the prompt for a Todoist task.
 
         Args:
             react_model (pydantic.BaseModel): The reactive model for the task.
             question (str): The question or task description.
+            tools (bool): Whether the actions are offered as tools instead of a JSON schema in the prompt.
 
         Returns:
             str: The system prompt for the Todoist task.
         '''
+        if tools:
+            # the tool definitions carry the schema, so it is not repeated in the prompt
+            response_format = "\nAnswer every message by calling one or more of the tools." + \
+                              "\nWrite your plan and interpretation of the observations in the thought argument." + \
+                              "\nCall several tools at once when they do not depend on each other's results." + \
+                              "\nI will preform the actions in order" + \
+                              " and respond with one observation per action."
+        else:
+            response_format = "\nSee the action in the json schema for the available tools." + \
+                              "\nIf you have insufficient information to answer the question," + \
+                              "you can use the tools to get more information." + \
+                              "\nAll your answers must be in json format and follow the following schema" + \
+                              " json schema:" + \
+                              f"{react_model.schema()}" + \
+                              "\nIf your json response asks me to preform actions, I will preform them in order." + \
+                              "\nI will then respond with one observation per action." + \
+                              "\nDo not write anything other than json!"
+        # the instructions and schema are the same for every question, so the question comes last
         prompt = "You are a getting things done (GTD) agent." + \
-                 f"\nIt is your job to accomplish the following task: {question}" + \
-                 "\nYou have access to multiple tools to accomplish this task." + \
-                 "\nSee the action in the json schema for the available tools." + \
-                 "\nIf you have insufficient information to answer the question," + \
-                 "you can use the tools to get more information." + \
-                 "\nAll your answers must be in json format and follow the following schema json schema:" + \
-                 f"{react_model.schema()}" + \
-                 "\nIf your json response asks me to preform an action, I will preform that action." + \
-                 "\nI will then respond with the result of that action." + \
-                 f"\nLet's begin to answer the question: {question}" + \
-                 "\nDo not write anything other than json!"
+                 "\nYou have access to multiple tools to accomplish your task." + \
+                 response_format + \
+                 f"\nIt is your job to accomplish the following task: {question}"
+        # excerpts left over from a document chat are not part of the agent's task
+        self.set_context("")
         return self.set_system_prompt("todoist", prompt)
 
+    def supports_tools(self):
+        '''
+        Returns whether the agent should answer through tool calls rather than JSON in the text.
+
+        Returns:
+            bool: True unless AGENT_MODE is "prompt" or, in "auto" mode, the engine lacks tool calling.
+        '''
+        if AGENT_MODE != "auto":
+            return AGENT_MODE == "tools"
+        return self.gpt_engine not in PROMPT_ONLY_ENGINES
+
     def set_system_prompt(self, content_type, ext_prompt):
         '''
         Sets the system prompt based on the content type.
@@ -106,34 +169,251 @@ class ChatBot:
         # add the extension prompt
         prompt += ext_prompt
         self.messages[0] = {"role": "system", "content": prompt}
+        self.dated = content_type == "general"
+
+    def set_context(self, context):
+        '''
+        Sets the document excerpts sent with the next requests.
+
+        They are placed after the chat history, so the system prompt and history stay
+        an unchanged prefix when the excerpts differ from request to request.
+
+        Args:
+            context (str): The excerpts, or an empty string for none.
+        '''
+        self.context = context
+
+    def _volatile_context(self):
+        '''
+        Returns the system content that changes between requests: today's date and the document excerpts.
+        '''
+        parts = [f"The current date is {date.today():%A, %B %d, %Y}."] if self.dated else []
+        if self.context:
+            parts.append(self.context)
+        return "\n".join(parts)
 
-    def send(self, role, content, temp, hist_len):
+    def send(self, role, content, temp, hist_len, cache=None):
         '''
         Sends a message to the chatbot and receives a response.
 
+        The system prompt is always sent, followed by the newest turns that fit the
+        model's token budget and hist_len; older turns are folded into a running summary.
+
         Args:
             role (str): The role of the message ("assistant" or "user").
             content (str): The content of the message.
             temp (float): The temperature for generating the response.
-            hist_len (int): The length of chat history to consider.
+            hist_len (int): The maximum number of history messages to consider.
+            cache (bool): Whether to use the response cache (default: None, only at temperature 0).
 
         Returns:
             str: The response from the chatbot.
         '''
-        self.messages.append({"role": role, "content": content})
-        messages = self.messages[-hist_len:]
+        return run_sync(self.asend(role, content, temp, hist_len, cache))
 
-        response = self.client.chat.completions.create(model=self.gpt_engine,
-                                                       messages=messages,
-                                                       temperature=temp)
+    async def asend(self, role, content, temp, hist_len, cache=None):
+        '''
+        Sends a message to the chatbot and receives a response, asynchronously.
 
-        message = response.choices[0].message.content.strip()
+        Must run on the shared event loop (see clients.run_sync and clients.submit).
+
+        Args:
+            role (str): The role of the message ("assistant" or "user").
+            content (str): The content of the message.
+            temp (float): The temperature for generating the response.
+            hist_len (int): The maximum number of history messages to consider.
+            cache (bool): Whether to use the response cache (default: None, only at temperature 0).
+
+        Returns:
+            str: The response from the chatbot.
+        '''
+        self.messages.append({"role": role, "content": content})
+        await self.window.compact(self.messages, self.gpt_engine, self._summarize, hist_len)
+        messages = self.window.build(self.messages, self.gpt_engine, hist_len, self._volatile_context())
+
+        message = await self.acomplete(messages, temp, cache)
 
         # add the message to the list of messages
         self.messages.append({"role": "assistant", "content": message})
 
         return message
 
+    async def acomplete(self, messages, temp, cache=None):
+        '''
+        Completes a list of messages without touching the chat history.
+
+        Args:
+            messages (list): The messages to send.
+            temp (float): The temperature for generating the response.
+            cache (bool): Whether to use the response cache (default: None, only at temperature 0).
+
+        Returns:
+            str: The response from the model.
+        '''
+        cache_key = self._cache_key(messages, temp, cache)
+        if cache_key:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                get_instrumentation().record({"kind": "llm_cache_hit", "name": self.gpt_engine}, 0.0)
+                return cached
+
+        start = time.perf_counter()
+        with get_instrumentation().span("llm", self.gpt_engine, model=self.gpt_engine) as span:
+            response = await self.async_client.chat.completions.create(model=self.gpt_engine,
+                                                                       messages=messages,
+                                                                       temperature=temp)
+            _record_response(span, response)
+        message = response.choices[0].message.content.strip()
+
+        if cache_key:
+            self.response_cache.put(cache_key, message, time.perf_counter() - start)
+        return message
+
+    def complete_many(self, requests, temp):
+        '''
+        Completes several lists of messages concurrently over the shared connection pool.
+
+        Args:
+            requests (list): The lists of messages to send.
+            temp (float): The temperature for generating the responses.
+
+        Returns:
+            list: The responses, in the order of the requests.
+        '''
+        async def gather():
+            return await asyncio.gather(*(self.acomplete(messages, temp) for messages in requests))
+        return run_sync(gather())
+
+    def stream(self, role, content, temp, hist_len, cache=None):
+        '''
+        Sends a message to the chatbot and yields the response as it is generated.
+
+        The full response is appended to the messages once the stream ends, or with
+        whatever was received if the caller stops iterating early.
+
+        Args:
+            role (str): The role of the message ("assistant" or "user").
+            content (str): The content of the message.
+            temp (float): The temperature for generating the response.
+            hist_len (int): The maximum number of history messages to consider.
+            cache (bool): Whether to use the response cache (default: None, only at temperature 0).
+
+        Yields:
+            str: The next piece of the response.
+        '''
+        messages = self._prepare(role, content, hist_len)
+
+        cache_key = self._cache_key(messages, temp, cache)
+        cached = self.response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            get_instrumentation().record({"kind": "llm_cache_hit", "name": self.gpt_engine}, 0.0)
+            self.messages.append({"role": "assistant", "content": cached})
+            yield cached
+            return
+
+        start = time.perf_counter()
+        span = {"kind": "llm", "name": self.gpt_engine, "model": self.gpt_engine, "stream": True}
+        # the usage arrives in a final chunk without choices; the pinned client has no
+        # stream_options argument, so the option is sent in the request body
+        response = self.client.chat.completions.create(model=self.gpt_engine,
+                                                       messages=messages,
+                                                       temperature=temp,
+                                                       stream=True,
+                                                       extra_body={"stream_options": {"include_usage": True}})
+        parts = []
+        try:
+            for chunk in response:
+                _record_usage(span, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not parts:
+                        span["first_token_seconds"] = time.perf_counter() - start
+                    parts.append(delta)
+                    yield delta
+            # only complete responses are cached
+            if cache_key:
+                self.response_cache.put(cache_key, "".join(parts).strip(), time.perf_counter() - start)
+        finally:
+            response.close()
+            self.messages.append({"role": "assistant", "content": "".join(parts).strip()})
+            span["bytes"] = len("".join(parts).encode())
+            if "prompt_tokens" not in span:
+                # a stream stopped early, or an endpoint that ignores stream_options, reports no usage
+                span["prompt_tokens"] = sum(message_tokens(m, self.gpt_engine) for m in messages)
+                span["completion_tokens"] = count_tokens("".join(parts), self.gpt_engine)
+            get_instrumentation().record(span, time.perf_counter() - start)
+
+    def call_tool(self, role, content, temp, hist_len, tools):
+        '''
+        Sends a message and asks the model to answer by calling one or more of the tools.
+
+        The calls are kept in the history as JSON text, so the history stays
+        plain text and reads the same as in the prompt-based mode.
+
+        Args:
+            role (str): The role of the message ("assistant" or "user").
+            content (str): The content of the message.
+            temp (float): The temperature for generating the response.
+            hist_len (int): The maximum number of history messages to consider.
+            tools (list): The tool definitions offered to the model.
+
+        Returns:
+            tuple: The (name, JSON arguments) pairs of the called tools, in order, and the
+            text response, which is only set if the model did not call a tool.
+        '''
+        messages = self._prepare(role, content, hist_len)
+        with get_instrumentation().span("llm", self.gpt_engine, model=self.gpt_engine, tools=True) as span:
+            response = self.client.chat.completions.create(model=self.gpt_engine,
+                                                           messages=messages,
+                                                           temperature=temp,
+                                                           tools=tools,
+                                                           tool_choice="required")
+            _record_response(span, response)
+        message = response.choices[0].message
+        if not message.tool_calls:
+            text = (message.content or "").strip()
+            self.messages.append({"role": "assistant", "content": text})
+            return [], text
+
+        calls = [(call.function.name, call.function.arguments) for call in message.tool_calls]
+        self.messages.append({"role": "assistant",
+                              "content": json.dumps([{"name": name, "arguments": args} for name, args in calls])})
+        return calls, ""
+
+    def _cache_key(self, messages, temp, cache):
+        '''
+        Returns the response cache key for a request, or None if the cache does not apply.
+
+        Args:
+            messages (list): The messages to send.
+            temp (float): The temperature for generating the response.
+            cache (bool): Whether the caller opted in or out, or None to cache only at temperature 0.
+
+        Returns:
+            str: The cache key, or None.
+        '''
+        if self.response_cache is None or cache is False or (cache is None and temp != 0):
+            return None
+        return self.response_cache.key(self.gpt_engine, messages, temp)
+
+    def _prepare(self, role, content, hist_len):
+        '''
+        Appends a message to the chat and selects the messages to send.
+
+        Args:
+            role (str): The role of the message ("assistant" or "user").
+            content (str): The content of the message.
+            hist_len (int): The maximum number of history messages to consider.
+
+        Returns:
+            list: The messages for the completion request.
+        '''
+        self.messages.append({"role": role, "content": content})
+        run_sync(self.window.compact(self.messages, self.gpt_engine, self._summarize, hist_len))
+        return self.window.build(self.messages, self.gpt_engine, hist_len, self._volatile_context())
+
     def set_message_content(self, index, content):
         '''
         Sets the content of a message in the chat.
@@ -143,3 +423,85 @@ class ChatBot:
             content (str): The new content for the message.
         '''
         self.messages[index]["content"] = content
+
+    def reset_history(self):
+        '''
+        Clears the chat history and its summary, keeping the system prompt.
+        '''
+        self.messages = self.messages[:1]
+        self.window.reset()
+
+    def fold(self, count):
+        '''
+        Folds the oldest turns of the chat history into the summary.
+
+        Args:
+            count (int): The number of turns to fold; the newest turn is always kept.
+        '''
+        count = min(count, len(self.messages) - 2)
+        if count > 0:
+            summary = run_sync(self._summarize(self.window.summary, self.messages[1:1 + count]))
+            self.window.fold(self.messages, count, summary)
+
+    async def _summarize(self, summary, messages):
+        '''
+        Folds messages into the running conversation summary.
+
+        This is the only summarization request; the synchronous paths run it with run_sync.
+
+        Args:
+            summary (str): The current summary, possibly empty.
+            messages (list): The messages to fold into the summary.
+
+        Returns:
+            str: The updated summary.
+        '''
+        transcript = "\n".join(f"{m['role'].upper()}: {m['content']}" for m in messages)
+        request = [{"role": "system", "content": SUMMARY_PROMPT},
+                   {"role": "user", "content": f"EXISTING SUMMARY:\n{summary}\n\nCONVERSATION:\n{transcript}"}]
+        with get_instrumentation().span("llm", self.gpt_engine, model=self.gpt_engine, summary=True) as span:
+            response = await self.async_client.chat.completions.create(model=self.gpt_engine,
+                                                                       messages=request,
+                                                                       temperature=0)
+            _record_response(span, response)
+        return response.choices[0].message.content.strip()
+
+
+def _record_response(span, response):
+    '''
+    Copies the token usage and the size of the output of a completion onto an instrumentation span.
+
+    The size counts the UTF-8 bytes of the text and of the tool call names and arguments the
+    model generated, the same as a streamed response's bytes.
+
+    Args:
+        span (dict): The span of the request.
+        response (ChatCompletion): The response.
+    '''
+    _record_usage(span, response.usage)
+    message = response.choices[0].message
+    span["bytes"] = len((message.content or "").encode()) + sum(
+        len(call.function.name.encode()) + len(call.function.arguments.encode())
+        for call in message.tool_calls or [])
+
+
+def _record_usage(span, usage):
+    '''
+    Copies the token usage reported by the API onto an instrumentation span.
+
+    Args:
+        span (dict): The span of the request.
+        usage (CompletionUsage): The usage of the response, if the API returned one. Streamed
+            chunks carry it as a plain dict.
+    '''
+    if isinstance(usage, dict):
+        usage = CompletionUsage.construct(**usage)
+    if usage is not None:
+        span["prompt_tokens"] = usage.prompt_tokens
+        span["completion_tokens"] = usage.completion_tokens
+        # prompt tokens served from the provider's prompt cache; older clients keep the details as a dict
+        details = getattr(usage, "prompt_tokens_details", None)
+        if isinstance(details, dict):
+            span["cached_tokens"] = details.get("cached_tokens") or 0
+        else:
+            span["cached_tokens"] = getattr(details, "cached_tokens", None) or 0
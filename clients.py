@@ -0,0 +1,132 @@
+import asyncio
+import contextvars
+import os
+import threading
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from rate_limiter import AsyncRateLimitedTransport, RateLimitedTransport, get_rate_limiter
+
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 100))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('OPENAI_MAX_KEEPALIVE_CONNECTIONS', 20))
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', 600))
+
+_clients = {}
+_lock = threading.Lock()
+_loop = None
+_loop_thread = None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS)
+
+
+def get_openai_client(api_key) -> OpenAI:
+    '''
+    Returns the process-wide synchronous OpenAI client for an API key.
+
+    Every ChatBot using the same key shares one connection pool, so sessions do not
+    repeat the TLS handshake or hold their own idle connections. Requests go through
+    the key's rate limiter, which also retries them when the API answers 429.
+
+    Args:
+        api_key (str): The OpenAI API key.
+
+    Returns:
+        OpenAI: The shared client.
+    '''
+    with _lock:
+        key = ("sync", api_key)
+        if key not in _clients:
+            transport = RateLimitedTransport(httpx.HTTPTransport(limits=_limits()),
+                                             get_rate_limiter("openai", api_key))
+            # the transport retries rate limited requests through the shared queue; SDK retries
+            # would multiply its attempts and sleep outside of it
+            _clients[key] = OpenAI(api_key=api_key, max_retries=0,
+                                   http_client=httpx.Client(transport=transport, timeout=OPENAI_TIMEOUT))
+        return _clients[key]
+
+
+def get_async_openai_client(api_key) -> AsyncOpenAI:
+    '''
+    Returns the process-wide asynchronous OpenAI client for an API key.
+
+    The client's connections belong to the shared event loop, so its coroutines must
+    run there, via `run_sync` or `submit`.
+
+    Args:
+        api_key (str): The OpenAI API key.
+
+    Returns:
+        AsyncOpenAI: The shared client.
+    '''
+    with _lock:
+        key = ("async", api_key)
+        if key not in _clients:
+            transport = AsyncRateLimitedTransport(httpx.AsyncHTTPTransport(limits=_limits()),
+                                                  get_rate_limiter("openai", api_key))
+            _clients[key] = AsyncOpenAI(api_key=api_key, max_retries=0,
+                                        http_client=httpx.AsyncClient(transport=transport, timeout=OPENAI_TIMEOUT))
+        return _clients[key]
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    '''
+    Returns the shared event loop, starting its background thread on first use.
+
+    Returns:
+        asyncio.AbstractEventLoop: The loop all async API calls run on.
+    '''
+    global _loop, _loop_thread
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="openai-event-loop", daemon=True)
+            _loop_thread.start()
+        return _loop
+
+
+def submit(coro):
+    '''
+    Schedules a coroutine on the shared event loop.
+
+    The coroutine sees the caller's context variables, such as the request priority.
+
+    Args:
+        coro (coroutine): The coroutine to run.
+
+    Returns:
+        concurrent.futures.Future: The future of the coroutine's result.
+    '''
+    return asyncio.run_coroutine_threadsafe(_in_context(coro, contextvars.copy_context()), get_event_loop())
+
+
+def run_sync(coro):
+    '''
+    Runs a coroutine on the shared event loop and waits for its result.
+
+    The coroutine sees the caller's context variables, such as the request priority.
+
+    Args:
+        coro (coroutine): The coroutine to run.
+
+    Returns:
+        Any: The coroutine's result.
+
+    Raises:
+        RuntimeError: If called from the shared event loop itself, which would deadlock.
+    '''
+    loop = get_event_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("run_sync cannot be called from the shared event loop; await the coroutine instead.")
+    return asyncio.run_coroutine_threadsafe(_in_context(coro, contextvars.copy_context()), loop).result()
+
+
+async def _in_context(coro, context):
+    # the task runs in a copy of the loop thread's context; carry over the caller's values
+    for var, value in context.items():
+        var.set(value)
+    return await coro
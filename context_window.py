@@ -0,0 +1,194 @@
+import os
+from functools import lru_cache
+
+from tokenizer import count_tokens
+
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4o": 128000,
+    "o1-preview": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-turbo-preview": 128000,
+    "gpt-4-1106-preview": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+COMPLETION_RESERVE_TOKENS = 4096
+# optional cap below the model's context window, e.g. to bound cost per turn
+MAX_PROMPT_TOKENS = int(os.environ.get('CHAT_MAX_PROMPT_TOKENS', 0)) or None
+# tokens of framing the API adds to every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=4096)
+def _content_tokens(content, model):
+    return count_tokens(content, model)
+
+
+def message_tokens(message, model=None) -> int:
+    '''
+    Counts the tokens a chat message costs in the prompt.
+
+    Args:
+        message (dict): The message with "role" and "content" keys.
+        model (str): The model whose encoding to use.
+
+    Returns:
+        int: The number of tokens.
+    '''
+    return _content_tokens(message["content"] or "", model) + MESSAGE_OVERHEAD_TOKENS
+
+
+class ConversationWindow:
+    '''
+    Selects the messages sent to the model within its token budget.
+
+    The system prompt is always kept. The remaining budget is filled with the newest
+    turns, and turns that no longer fit, or fall outside the history length, are folded
+    into a running summary.
+
+    Attributes:
+        summary (str): The summary of the turns folded out of the history.
+    '''
+
+    def __init__(self, max_prompt_tokens=MAX_PROMPT_TOKENS, reserve_tokens=COMPLETION_RESERVE_TOKENS):
+        '''
+        Initializes a ConversationWindow instance.
+
+        Args:
+            max_prompt_tokens (int): A cap on the prompt size (default: None, the model's context window).
+            reserve_tokens (int): The tokens left free for the completion.
+        '''
+        self.max_prompt_tokens = max_prompt_tokens
+        self.reserve_tokens = reserve_tokens
+        self.summary = ""
+
+    def prompt_budget(self, model) -> int:
+        '''
+        Returns the number of prompt tokens available for a model.
+
+        Args:
+            model (str): The model name.
+
+        Returns:
+            int: The prompt token budget.
+        '''
+        budget = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS) - self.reserve_tokens
+        if self.max_prompt_tokens:
+            budget = min(budget, self.max_prompt_tokens)
+        return budget
+
+    def summary_message(self):
+        '''
+        Returns the summary as a system message, or None if nothing was summarized yet.
+        '''
+        if not self.summary:
+            return None
+        return {"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"}
+
+    def build(self, messages, model, hist_len=None, context=None) -> list[dict]:
+        '''
+        Selects the messages to send for the next completion.
+
+        Content that changes from request to request goes in `context`, which is placed
+        after the history, just before the newest turn. The system prompt and the earlier
+        turns then form the same prefix in every request, which providers can serve from
+        their prompt cache.
+
+        Args:
+            messages (list): The chat history, with the system prompt at index 0.
+            model (str): The model name.
+            hist_len (int): The maximum number of turns to include (default: None, no limit).
+            context (str): Volatile system content such as the date or document excerpts (default: None).
+
+        Returns:
+            list: The system prompt, the summary if any, the newest turns that fit the budget
+            and the context before the last of them.
+        '''
+        head = [messages[0]]
+        summary = self.summary_message()
+        if summary:
+            head.append(summary)
+        tail = [{"role": "system", "content": context}] if context else []
+        budget = self.prompt_budget(model) - sum(message_tokens(m, model) for m in head + tail)
+
+        turns = messages[1:]
+        if hist_len is not None:
+            turns = turns[-hist_len:] if hist_len > 0 else []
+        selected = []
+        for message in reversed(turns):
+            tokens = message_tokens(message, model)
+            # the newest turn is always sent, even if it alone exceeds the budget
+            if selected and tokens > budget:
+                break
+            selected.append(message)
+            budget -= tokens
+        selected.reverse()
+        return head + selected[:-1] + tail + selected[-1:]
+
+    def overflow(self, messages, model, hist_len=None) -> int:
+        '''
+        Returns how many of the oldest turns should be folded into the summary.
+
+        Nothing is folded until the history outgrows the budget or has more than hist_len
+        turns; it is then cut back to half the budget or half of hist_len at a time, so
+        summarization runs rarely rather than on every turn.
+
+        Args:
+            messages (list): The chat history, with the system prompt at index 0.
+            model (str): The model name.
+            hist_len (int): The maximum number of turns sent (default: None, no limit).
+
+        Returns:
+            int: The number of turns to fold, possibly zero.
+        '''
+        budget = self.prompt_budget(model) - message_tokens(messages[0], model)
+        turn_tokens = [message_tokens(m, model) for m in messages[1:]]
+
+        count = 0
+        # always keep the newest turn in the history
+        if hist_len is not None and len(turn_tokens) > max(hist_len, 1):
+            count = len(turn_tokens) - max(hist_len // 2, 1)
+        total = sum(turn_tokens[count:])
+        if total > budget:
+            while count < len(turn_tokens) - 1 and total > budget // 2:
+                total -= turn_tokens[count]
+                count += 1
+        return count
+
+    def fold(self, messages, count, summary):
+        '''
+        Replaces the summary and drops the turns it now covers. `messages` is modified in place.
+
+        Args:
+            messages (list): The chat history, with the system prompt at index 0.
+            count (int): The number of oldest turns covered by the new summary.
+            summary (str): The new summary.
+        '''
+        self.summary = summary
+        del messages[1:1 + count]
+
+    async def compact(self, messages, model, summarize, hist_len=None) -> int:
+        '''
+        Folds the oldest turns into the summary once the history outgrows the budget or hist_len.
+
+        Args:
+            messages (list): The chat history, with the system prompt at index 0.
+            model (str): The model name.
+            summarize (callable): A coroutine function called with the current summary and the turns to
+                fold; returns the new summary.
+            hist_len (int): The maximum number of turns sent (default: None, no limit).
+
+        Returns:
+            int: The number of turns folded into the summary.
+        '''
+        count = self.overflow(messages, model, hist_len)
+        if count:
+            self.fold(messages, count, await summarize(self.summary, messages[1:1 + count]))
+        return count
+
+    def reset(self):
+        '''
+        Forgets the summary, e.g. when the chat history is cleared.
+        '''
+        self.summary = ""
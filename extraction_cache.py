@@ -0,0 +1,200 @@
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# Bump whenever the extraction logic changes so stale cached text is never served.
+EXTRACTOR_VERSION = "2"
+CACHE_MAX_BYTES = int(os.environ.get('EXTRACTION_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+CACHE_DIR = os.environ.get('EXTRACTION_CACHE_DIR', None)
+
+
+class ExtractionCache:
+    '''
+    A cache of extracted document text keyed by a hash of the file bytes.
+
+    The in-process tier is an LRU bounded by the approximate size of the cached text.
+    The optional on-disk tier stores one text file per key so results survive restarts.
+
+    Attributes:
+        max_bytes (int): The byte budget of the in-process tier.
+        cache_dir (Path): The directory of the on-disk tier, or None to disable it.
+        version (str): The extractor version mixed into every key.
+        hits (int): The number of lookups served from memory.
+        disk_hits (int): The number of lookups served from disk.
+        misses (int): The number of lookups that required extraction.
+    '''
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, cache_dir=CACHE_DIR, version=EXTRACTOR_VERSION):
+        '''
+        Initializes an ExtractionCache instance.
+
+        Args:
+            max_bytes (int): The byte budget of the in-process tier.
+            cache_dir (str): The directory of the on-disk tier (default: None, memory only).
+            version (str): The extractor version mixed into every key.
+        '''
+        self.max_bytes = max_bytes
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.version = version
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, data, file_type):
+        '''
+        Builds the cache key for a document.
+
+        Args:
+            data (bytes): The raw file contents.
+            file_type (str): The file extension, e.g. "pdf".
+
+        Returns:
+            str: The hex digest identifying the extracted text.
+        '''
+        digest = hashlib.sha256()
+        digest.update(f"{self.version}:{file_type}:".encode())
+        digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        '''
+        Looks up extracted text, promoting disk hits into memory.
+
+        Args:
+            key (str): The key returned by `key`.
+
+        Returns:
+            str: The cached text, or None on a miss.
+        '''
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        text = self._read_disk(key)
+        if text is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, text)
+        return text
+
+    def put(self, key, text):
+        '''
+        Stores extracted text in memory and, if enabled, on disk.
+
+        Args:
+            key (str): The key returned by `key`.
+            text (str): The extracted text.
+        '''
+        with self._lock:
+            self._remember(key, text)
+        self._write_disk(key, text)
+
+    def get_or_extract(self, data, file_type, extract):
+        '''
+        Returns the cached text for a document, extracting it on a miss.
+
+        Args:
+            data (bytes): The raw file contents.
+            file_type (str): The file extension, e.g. "pdf".
+            extract (callable): Called with no arguments to extract the text on a miss.
+
+        Returns:
+            str: The extracted text.
+        '''
+        key = self.key(data, file_type)
+        text = self.get(key)
+        if text is None:
+            text = extract()
+            self.put(key, text)
+        return text
+
+    def stats(self):
+        '''
+        Returns the hit/miss counters and the current memory footprint.
+
+        Returns:
+            dict: The cache statistics.
+        '''
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+    def clear(self):
+        '''
+        Drops the in-process tier. The on-disk tier is left untouched.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remember(self, key, text):
+        # callers must hold the lock
+        if key in self._entries:
+            self._size -= sys.getsizeof(self._entries.pop(key))
+        size = sys.getsizeof(text)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = text
+        self._size += size
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= sys.getsizeof(evicted)
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.txt"
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            return self._path(key).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key, text):
+        if not self.cache_dir:
+            return
+        # write to a temporary file first so a crash never leaves a truncated entry
+        tmp_path = self._path(key).with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, self._path(key))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> ExtractionCache:
+    '''
+    Returns the process-wide extraction cache.
+
+    The cache lives in this module rather than in the Streamlit script so that it
+    survives reruns and is shared by every session.
+
+    Returns:
+        ExtractionCache: The shared cache instance.
+    '''
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExtractionCache()
+        return _cache
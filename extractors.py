@@ -0,0 +1,226 @@
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator
+
+from instrumentation import get_instrumentation
+from tokenizer import count_tokens
+
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = 32
+PDF_PARALLEL_MIN_PAGES = 64
+
+# extension -> function yielding the text parts of a document; filled by register_extractor
+EXTRACTORS: dict[str, Callable[[bytes], Iterator[str]]] = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    # the pool is shared by every session; spawn avoids forking a multi-threaded server
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def register_extractor(*extensions) -> Callable:
+    '''
+    Registers a text extractor for one or more file extensions.
+
+    Used as a decorator on a function that takes the raw file contents and yields the
+    text of the document in parts. Extractors import their parsing libraries when they
+    are first called, so registering a format costs nothing until such a file arrives.
+
+    Args:
+        extensions (str): The file extensions, without the dot, e.g. "pdf".
+
+    Returns:
+        callable: The decorator, which returns the function unchanged.
+    '''
+    def register(extract: Callable[[bytes], Iterator[str]]) -> Callable[[bytes], Iterator[str]]:
+        for extension in extensions:
+            EXTRACTORS[extension.lower().lstrip(".")] = extract
+        return extract
+    return register
+
+
+def supported_file_types() -> list[str]:
+    '''
+    Returns the file extensions that have a registered extractor.
+
+    Returns:
+        list: The extensions, sorted.
+    '''
+    return sorted(EXTRACTORS)
+
+
+def _extract_pdf_range(path, start, stop) -> list[str]:
+    import fitz
+
+    with fitz.open(path) as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+
+@register_extractor("pdf")
+def iter_pdf_text(data) -> Iterator[str]:
+    '''
+    Yields the text of a PDF one page at a time.
+
+    Large documents are split into page ranges that are extracted in a process pool;
+    pages are still yielded in document order.
+
+    Args:
+        data (bytes): The raw file contents.
+
+    Yields:
+        str: The text of each page.
+    '''
+    import fitz
+
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        page_count = doc.page_count
+        if page_count < PDF_PARALLEL_MIN_PAGES or EXTRACTION_WORKERS < 2:
+            for page in doc:
+                yield page.get_text()
+            return
+
+    # the workers read the document from disk so the bytes are not pickled per task
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(data)
+    executor = _get_executor()
+    futures = [executor.submit(_extract_pdf_range, tmp.name, start, min(start + PDF_PAGES_PER_TASK, page_count))
+               for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        os.unlink(tmp.name)
+
+
+@register_extractor("docx")
+def iter_docx_text(data) -> Iterator[str]:
+    '''
+    Yields the text of a Word document one table at a time, followed by the paragraphs.
+
+    Args:
+        data (bytes): The raw file contents.
+
+    Yields:
+        str: The text of each table, then of the body paragraphs.
+    '''
+    from docx import Document
+
+    doc = Document(io.BytesIO(data))
+    for i, table in enumerate(doc.tables):
+        cells = [f"\nTable {i+1}"]
+        for row in table.rows:
+            for cell in row.cells:
+                cells.append(cell.text)
+        yield "\n".join(cells)
+    yield "\n".join(para.text for para in doc.paragraphs)
+
+
+@register_extractor("pptx")
+def iter_pptx_text(data) -> Iterator[str]:
+    '''
+    Yields the text of a PowerPoint deck one slide at a time.
+
+    Args:
+        data (bytes): The raw file contents.
+
+    Yields:
+        str: The text of each slide.
+    '''
+    from pptx import Presentation
+
+    prs = Presentation(io.BytesIO(data))
+    for slide_number, slide in enumerate(prs.slides):
+        shapes = [f"\nSlide {slide_number + 1}"]
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                shapes.append(shape.text)
+        yield "\n".join(shapes)
+
+
+@register_extractor("txt", "md")
+def iter_plain_text(data) -> Iterator[str]:
+    '''
+    Yields the text of a plain text or Markdown file.
+
+    Args:
+        data (bytes): The raw file contents, UTF-8 encoded.
+
+    Yields:
+        str: The whole text.
+    '''
+    yield data.decode("utf-8", errors="replace")
+
+
+def iter_text(data, file_type) -> Iterator[str]:
+    '''
+    Yields the text of a document one page, slide or table at a time.
+
+    Args:
+        data (bytes): The raw file contents.
+        file_type (str): The file extension, e.g. "pdf".
+
+    Yields:
+        str: The text of each part of the document.
+
+    Raises:
+        ValueError: If the file type is not supported.
+    '''
+    extract = EXTRACTORS.get(file_type.lower())
+    if extract is None:
+        raise ValueError(f"Unsupported file type: {file_type}")
+    return extract(data)
+
+
+def extract_text(data, file_type, max_chars=None, max_tokens=None, model=None) -> str:
+    '''
+    Extracts the text of a document, optionally stopping once a budget is reached.
+
+    Args:
+        data (bytes): The raw file contents.
+        file_type (str): The file extension, e.g. "pdf".
+        max_chars (int): Stop after this many characters (default: None, no limit).
+        max_tokens (int): Stop after this many tokens (default: None, no limit).
+        model (str): The model whose encoding is used to count tokens.
+
+    Returns:
+        str: The extracted text, truncated to `max_chars` if given.
+
+    Raises:
+        ValueError: If the file type is not supported.
+    '''
+    with get_instrumentation().span("extraction", file_type, bytes=len(data)) as span:
+        parts = []
+        chars = 0
+        tokens = 0
+        parts_iter = iter_text(data, file_type)
+        try:
+            for part in parts_iter:
+                parts.append(part)
+                chars += len(part) + 1
+                if max_tokens is not None:
+                    tokens += count_tokens(part, model)
+                    if tokens >= max_tokens:
+                        break
+                if max_chars is not None and chars >= max_chars:
+                    break
+        finally:
+            # stop the generator early so pending work is cancelled
+            parts_iter.close()
+
+        text = "\n".join(parts)
+        span["parts"] = len(parts)
+    return text[:max_chars] if max_chars is not None else text
@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+HISTORY_PATH = os.environ.get('HISTORY_PATH', 'logs/history.sqlite')
+# turns rendered per page of the chat; older pages are loaded on demand
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 20))
+
+
+def new_conversation_id() -> str:
+    '''
+    Returns a new random conversation id.
+
+    Returns:
+        str: The id, safe to use in a URL.
+    '''
+    return uuid.uuid4().hex
+
+
+class HistoryStore:
+    '''
+    An append-only store of chat turns backed by SQLite.
+
+    Turns are keyed by conversation and numbered in order, so a conversation survives
+    server restarts and any page of it can be read without loading the rest. Clearing a
+    chat starts a new conversation; stored turns are never changed.
+    '''
+
+    def __init__(self, path=HISTORY_PATH):
+        '''
+        Initializes a HistoryStore instance.
+
+        Args:
+            path (str): The SQLite database file, or ":memory:".
+        '''
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "conversation TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+            "created_at REAL NOT NULL, PRIMARY KEY (conversation, seq))")
+
+    def append(self, conversation_id, role, content) -> int:
+        '''
+        Appends a turn to a conversation.
+
+        Args:
+            conversation_id (str): The conversation.
+            role (str): The role of the message ("user" or "assistant").
+            content (str): The content of the message.
+
+        Returns:
+            int: The position of the turn in the conversation, starting at 0.
+        '''
+        with self._lock:
+            seq = self._db.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM turns WHERE conversation = ?",
+                                   (conversation_id,)).fetchone()[0]
+            self._db.execute("INSERT INTO turns VALUES (?, ?, ?, ?, ?)",
+                             (conversation_id, seq, role, content, time.time()))
+            return seq
+
+    def count(self, conversation_id) -> int:
+        '''
+        Returns the number of turns in a conversation.
+
+        Args:
+            conversation_id (str): The conversation.
+
+        Returns:
+            int: The number of turns.
+        '''
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM turns WHERE conversation = ?",
+                                    (conversation_id,)).fetchone()[0]
+
+    def recent(self, conversation_id, limit) -> list[dict]:
+        '''
+        Returns the newest turns of a conversation, oldest first.
+
+        Args:
+            conversation_id (str): The conversation.
+            limit (int): The most turns to return.
+
+        Returns:
+            list: The turns as messages with "role" and "content" keys.
+        '''
+        with self._lock:
+            rows = self._db.execute("SELECT role, content FROM turns WHERE conversation = ? "
+                                    "ORDER BY seq DESC LIMIT ?", (conversation_id, limit)).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history_store() -> HistoryStore:
+    '''
+    Returns the process-wide history store.
+
+    Returns:
+        HistoryStore: The shared store.
+    '''
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore()
+        return _store
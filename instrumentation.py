@@ -0,0 +1,267 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+# spans kept per kind and name for the percentiles
+INSTRUMENTATION_MAX_SPANS = int(os.environ.get('INSTRUMENTATION_MAX_SPANS', 2000))
+# when set, a background thread writes autogpt.prom and appends spans.jsonl here
+INSTRUMENTATION_EXPORT_DIR = os.environ.get('INSTRUMENTATION_EXPORT_DIR')
+INSTRUMENTATION_EXPORT_INTERVAL = float(os.environ.get('INSTRUMENTATION_EXPORT_INTERVAL', 15))
+
+# US dollars per 1000 prompt and completion tokens, for the cost estimate
+MODEL_PRICES = {
+    'gpt-4o': (0.005, 0.015),
+    'o1-preview': (0.015, 0.06),
+    'o1-mini': (0.003, 0.012),
+    'gpt-4-turbo': (0.01, 0.03),
+    'gpt-4-turbo-preview': (0.01, 0.03),
+    'gpt-4-1106-preview': (0.01, 0.03),
+    'gpt-4': (0.03, 0.06),
+    'gpt-3.5-turbo': (0.0005, 0.0015),
+}
+QUANTILES = (0.5, 0.9, 0.99)
+COUNTERS = ('prompt_tokens', 'completion_tokens', 'cached_tokens', 'bytes', 'cost')
+
+_ID_RE = re.compile(r'/\d+')
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens) -> float:
+    '''
+    Estimates the price of a completion.
+
+    Args:
+        model (str): The model name.
+        prompt_tokens (int): The tokens sent.
+        completion_tokens (int): The tokens received.
+
+    Returns:
+        float: The cost in US dollars, or 0 for models without a known price.
+    '''
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+def http_span_name(method, url) -> str:
+    '''
+    Names an HTTP span by method and path, with numeric ids replaced so names stay few.
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The request URL.
+
+    Returns:
+        str: The span name, e.g. "DELETE /rest/v2/projects/:id".
+    '''
+    path = re.sub(r'^[a-z]+://[^/]+', '', url).split('?', 1)[0]
+    return f"{method} {_ID_RE.sub('/:id', path)}"
+
+
+class Instrumentation:
+    '''
+    Collects timed spans of LLM requests, JSON repairs, document extraction and Todoist HTTP calls.
+
+    Each span records its kind, a name (such as the model or the HTTP route), its duration
+    and, where they apply, tokens, cached prompt tokens, bytes and cost. Totals are kept for the lifetime of the
+    process; percentiles are taken over the most recent spans of each kind and name.
+    '''
+
+    def __init__(self, max_spans=INSTRUMENTATION_MAX_SPANS):
+        '''
+        Initializes an Instrumentation instance.
+
+        Args:
+            max_spans (int): The recent spans kept per kind and name.
+        '''
+        self.max_spans = max_spans
+        self._recent = {}
+        self._totals = {}
+        self._unexported = deque(maxlen=max_spans * 10)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, kind, name='', **attributes):
+        '''
+        Times the enclosed block and records it as a span.
+
+        The yielded dict may be updated inside the block, e.g. with the token counts of
+        the response. A span is marked as an error if the block raises.
+
+        Args:
+            kind (str): The kind of call, e.g. "llm", "repair", "extraction" or "todoist_http".
+            name (str): What was called, e.g. the model name.
+            **attributes: Further fields of the span.
+
+        Yields:
+            dict: The span.
+        '''
+        span = {'kind': kind, 'name': name, 'error': False, **attributes}
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            span['error'] = True
+            raise
+        finally:
+            self.record(span, time.perf_counter() - start)
+
+    def record(self, span, duration):
+        '''
+        Records a finished span.
+
+        Args:
+            span (dict): The span, with at least "kind" and "name".
+            duration (float): How long the call took in seconds.
+        '''
+        span = {**span, 'duration': duration, 'time': time.time()}
+        if 'cost' not in span and 'model' in span:
+            span['cost'] = estimate_cost(span['model'], span.get('prompt_tokens', 0),
+                                         span.get('completion_tokens', 0))
+        key = (span['kind'], span['name'])
+        with self._lock:
+            if key not in self._recent:
+                self._recent[key] = deque(maxlen=self.max_spans)
+                self._totals[key] = {'count': 0, 'errors': 0, 'seconds': 0.0, **{c: 0 for c in COUNTERS}}
+            self._recent[key].append(duration)
+            totals = self._totals[key]
+            totals['count'] += 1
+            totals['errors'] += bool(span.get('error'))
+            totals['seconds'] += duration
+            for counter in COUNTERS:
+                totals[counter] += span.get(counter) or 0
+            self._unexported.append(span)
+
+    def summary(self) -> list[dict]:
+        '''
+        Aggregates the spans per kind and name.
+
+        Returns:
+            list: One dict per kind and name with the count, errors, latency percentiles
+            and the totals of tokens, bytes and cost.
+        '''
+        with self._lock:
+            items = [(key, sorted(self._recent[key]), dict(self._totals[key])) for key in self._totals]
+        rows = []
+        for (kind, name), durations, totals in sorted(items):
+            row = {'kind': kind, 'name': name, **totals}
+            for q in QUANTILES:
+                row[f'p{int(q * 100)}'] = quantile(durations, q)
+            rows.append(row)
+        return rows
+
+    def prometheus(self) -> str:
+        '''
+        Renders the aggregates in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics, e.g. for the node_exporter textfile collector.
+        '''
+        lines = [
+            '# HELP autogpt_span_seconds Duration of instrumented calls.',
+            '# TYPE autogpt_span_seconds summary',
+        ]
+        rows = self.summary()
+        for row in rows:
+            labels = f'kind="{row["kind"]}",name="{_escape(row["name"])}"'
+            for q in QUANTILES:
+                lines.append(f'autogpt_span_seconds{{{labels},quantile="{q}"}} {row[f"p{int(q * 100)}"]}')
+            lines.append(f'autogpt_span_seconds_sum{{{labels}}} {row["seconds"]}')
+            lines.append(f'autogpt_span_seconds_count{{{labels}}} {row["count"]}')
+        metrics = (
+            ('errors', 'autogpt_span_errors_total', 'Instrumented calls that failed.'),
+            ('prompt_tokens', 'autogpt_prompt_tokens_total', 'Tokens sent to the model.'),
+            ('completion_tokens', 'autogpt_completion_tokens_total', 'Tokens received from the model.'),
+            ('cached_tokens', 'autogpt_cached_prompt_tokens_total', 'Prompt tokens served from the provider cache.'),
+            ('bytes', 'autogpt_bytes_total', 'Bytes received or processed.'),
+            ('cost', 'autogpt_cost_dollars_total', 'Estimated model cost in US dollars.'),
+        )
+        for field, metric, description in metrics:
+            lines += [f'# HELP {metric} {description}', f'# TYPE {metric} counter']
+            for row in rows:
+                lines.append(f'{metric}{{kind="{row["kind"]}",name="{_escape(row["name"])}"}} {row[field]}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, directory=INSTRUMENTATION_EXPORT_DIR):
+        '''
+        Writes the Prometheus metrics to autogpt.prom and appends the spans recorded since
+        the last export to spans.jsonl.
+
+        Args:
+            directory (str): Where to write the files.
+        '''
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            spans, self._unexported = list(self._unexported), deque(maxlen=self._unexported.maxlen)
+        if spans:
+            with open(path / 'spans.jsonl', 'a') as f:
+                f.writelines(json.dumps(span) + '\n' for span in spans)
+        # replace the file at once so a scraper never reads half of it
+        tmp_path = path / f'autogpt.prom.{os.getpid()}.tmp'
+        tmp_path.write_text(self.prometheus())
+        os.replace(tmp_path, path / 'autogpt.prom')
+
+    def reset(self):
+        '''
+        Forgets all spans and totals.
+        '''
+        with self._lock:
+            self._recent.clear()
+            self._totals.clear()
+            self._unexported.clear()
+
+
+def quantile(sorted_values, q) -> float:
+    '''
+    Returns a quantile of sorted values by the nearest-rank method.
+
+    Args:
+        sorted_values (list): The values, in ascending order.
+        q (float): The quantile, between 0 and 1, e.g. 0.9 for p90.
+
+    Returns:
+        float: The value at the quantile, or 0 if there are no values.
+    '''
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _export_loop(instrumentation, directory, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            instrumentation.export(directory)
+        except OSError:
+            # a full disk or a removed directory must not stop the app; try again next time
+            continue
+
+
+_instrumentation = None
+_instrumentation_lock = threading.Lock()
+
+
+def get_instrumentation() -> Instrumentation:
+    '''
+    Returns the process-wide instrumentation, starting the exporter if INSTRUMENTATION_EXPORT_DIR is set.
+
+    Returns:
+        Instrumentation: The shared instance.
+    '''
+    global _instrumentation
+    with _instrumentation_lock:
+        if _instrumentation is None:
+            _instrumentation = Instrumentation()
+            if INSTRUMENTATION_EXPORT_DIR:
+                threading.Thread(target=_export_loop,
+                                 args=(_instrumentation, INSTRUMENTATION_EXPORT_DIR, INSTRUMENTATION_EXPORT_INTERVAL),
+                                 name='instrumentation-export', daemon=True).start()
+        return _instrumentation
@@ -1,15 +1,35 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import threading
 import coloredlogs
+from datetime import datetime, timezone
 from pathlib import Path
 
 LOG_LEVEL = os.environ.get('LOGLEVEL', 'INFO').upper()
+LOG_FILE_LEVEL = os.environ.get('LOG_FILE_LEVEL', 'DEBUG').upper()
+# "text" or "json" (one JSON object per line) for the log file
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+# rotate by size unless LOG_ROTATE_WHEN names a time interval such as "midnight" or "H"
+LOG_ROTATE_BYTES = int(os.environ.get('LOG_ROTATE_BYTES', 10 * 1024 * 1024))
+LOG_ROTATE_WHEN = os.environ.get('LOG_ROTATE_WHEN')
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+# records waiting for the writer thread; beyond this they are dropped rather than blocking the caller
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
 TRACE_LEVEL = 9
 DEBUG_LOG_FMT = '[{asctime}] [{levelname:4}] {name} -- {message}'
-DEBUG_LOG_PATH = 'logs/autogpt.log'
+DEBUG_LOG_PATH = os.environ.get('LOG_PATH', 'logs/autogpt.log')
 
 logging.addLevelName(TRACE_LEVEL, 'TRACE')
 
+_queue_handler = None
+_listener = None
+_configure_lock = threading.Lock()
+
 
 def _trace_fn(self, message=None, *args, **kwargs):
     if self.isEnabledFor(TRACE_LEVEL):
@@ -19,23 +39,71 @@ def _trace_fn(self, message=None, *args, **kwargs):
 logging.Logger.trace = _trace_fn
 
 
-def get_logger(name) -> logging.Logger:
-    # create logger
-    logger = logging.getLogger(name)
+class JsonLineFormatter(logging.Formatter):
+    '''
+    Formats each record as one JSON object per line.
+    '''
+
+    def format(self, record) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Hands records to the writer thread with as little work as possible in the caller.
+
+    Formatting, including exception tracebacks, is left to the writer; only the message
+    arguments are merged so later changes to them do not leak into the log. Records
+    that do not fit in the queue are counted and dropped instead of blocking.
+    '''
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _file_handler() -> logging.Handler:
+    Path(DEBUG_LOG_PATH).parent.mkdir(exist_ok=True)
+    if LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(DEBUG_LOG_PATH, when=LOG_ROTATE_WHEN,
+                                                            backupCount=LOG_BACKUP_COUNT)
+    else:
+        handler = logging.handlers.RotatingFileHandler(DEBUG_LOG_PATH, maxBytes=LOG_ROTATE_BYTES,
+                                                       backupCount=LOG_BACKUP_COUNT)
+    handler.setLevel(LOG_FILE_LEVEL)
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonLineFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(DEBUG_LOG_FMT, style='{'))
+    return handler
+
 
-    # create console handler and set level to debug
-    if not any(isinstance(handler, logging.FileHandler) for handler in logger.handlers):
-        Path(DEBUG_LOG_PATH).parent.mkdir(exist_ok=True)
-        fh = logging.FileHandler(DEBUG_LOG_PATH)
-        fh.setLevel(logging.DEBUG)
-        formatter = logging.Formatter(DEBUG_LOG_FMT, style='{')
-        fh.setFormatter(formatter)
-        logger.addHandler(fh)
-
-    # set log format
-    coloredlogs.install(
-        logger=logger,
-        level=LOG_LEVEL,
+def _console_handler() -> logging.Handler:
+    handler = logging.StreamHandler()
+    handler.setLevel(LOG_LEVEL)
+    handler.setFormatter(coloredlogs.ColoredFormatter(
         fmt=DEBUG_LOG_FMT,
         style='{',
         field_styles={
@@ -48,8 +116,60 @@ def get_logger(name) -> logging.Logger:
             'warning': {'color': 'yellow'},
             'error': {'color': 'red'}
         }
-    )
+    ))
+    return handler
+
+
+def _configure() -> logging.Handler:
+    '''
+    Starts the process-wide log writer on first use.
+
+    Returns:
+        logging.Handler: The queue handler that every logger hands its records to.
+    '''
+    global _queue_handler, _listener
+    with _configure_lock:
+        if _queue_handler is None:
+            log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            _listener = logging.handlers.QueueListener(log_queue, _file_handler(), _console_handler(),
+                                                       respect_handler_level=True)
+            _listener.start()
+            # flush what is still queued when the process exits
+            atexit.register(_listener.stop)
+            _queue_handler = _DeferredQueueHandler(log_queue)
+        return _queue_handler
+
+
+def dropped_records() -> int:
+    '''
+    Returns how many log records were dropped because the queue was full.
+
+    Returns:
+        int: The number of dropped records.
+    '''
+    return _queue_handler.dropped if _queue_handler else 0
+
+
+def get_logger(name) -> logging.Logger:
+    '''
+    Returns a logger whose records are written by a single background thread.
+
+    Calling it again, e.g. on a Streamlit rerun, returns the same logger without
+    adding handlers.
+
+    Args:
+        name (str): The name of the logger.
+
+    Returns:
+        logging.Logger: The logger.
+    '''
+    logger = logging.getLogger(name)
 
-    logger.propagate = False
+    handler = _configure()
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+        # the handlers on the writer side filter by level; the logger lets through what either wants
+        logger.setLevel(min(logging.getLevelName(LOG_LEVEL), logging.getLevelName(LOG_FILE_LEVEL)))
+        logger.propagate = False
 
     return logger
@@ -1,13 +1,20 @@
+import contextvars
 import os
 import json
-import fitz
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
-from docx import Document
-from pptx import Presentation
-from streamlit_chat import message
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from chatbot import ChatBot
-from todoist_repair_agent import parse_base_model_with_retries
-from todoist_agent.todoist_action_toolkit import TodoistActionToolKit
+from extraction_cache import get_extraction_cache
+from extractors import extract_text, supported_file_types
+from history_store import HISTORY_PAGE_SIZE, get_history_store, new_conversation_id
+from instrumentation import get_instrumentation
+from rate_limiter import rate_limit_stats, request_priority
+from response_cache import get_response_cache
+from retrieval import get_document_index
+from session_manager import get_session_manager
+from todoist_repair_agent import JsonObjectScanner, parse_base_model_with_retries
+from todoist_agent.observations import OBSERVATION_MAX_ROWS, encode_projects, encode_tasks
 from todoist_agent.models import (
     ReactResponse,
     CreateNewProjectAction,
@@ -16,58 +23,304 @@ from todoist_agent.models import (
     GetAllTasksAction,
     GiveFinalAnswerAction,
     MoveTaskAction,
+    MoveTasksAction,
+    QueryTasksAction,
+    READ_ONLY_ACTIONS,
+    react_tool_calls,
+    react_tools,
 )
 from logger import get_logger
 
+# read-only actions of one plan that run at the same time
+READ_ACTION_WORKERS = int(os.getenv("READ_ACTION_WORKERS", 4))
+# stored turns given back to the model when a conversation is reopened, the largest history length
+HISTORY_CONTEXT_TURNS = 50
+
+
+def message(*args, **kwargs):
+    """
+    Render a chat message with streamlit_chat, which is only imported once a message is shown.
+
+    Args:
+        *args: Passed on to streamlit_chat.message.
+        **kwargs: Passed on to streamlit_chat.message.
+    """
+    from streamlit_chat import message as chat_message
+
+    return chat_message(*args, **kwargs)
+
 
 def read_text_from_file(file, log):
     """
-    Read the contents of a .docx file and return the full text.
+    Read the contents of an uploaded document and return the full text.
+
+    Extracted text is cached by a hash of the file contents, so reruns with unchanged
+    uploads do not parse the document again.
 
     Args:
-        file (str): The path to the .docx file.
+        file (UploadedFile): The uploaded file, of any type with a registered extractor.
+        log (logging.Logger): The logger to use.
 
     Returns:
-        str: The full text extracted from the .docx file.
+        str: The full text extracted from the file.
     """
-    log.info(f"Reading text from file: {file}")
     file_type = file.name.split(".")[-1].lower()
-    if file_type == "docx":
-        doc = Document(file)
-        full_text = []
-        for i in range(0, len(doc.tables)):
-            full_text.append(f"\nTable {i+1}")
-            table = doc.tables[i]
-            for row in table.rows:
-                for cell in row.cells:
-                    full_text.append(cell.text)
-        for para in doc.paragraphs:
-            full_text.append(para.text)
-        return "\n".join(full_text)
-    elif file_type == "pptx":
-        prs = Presentation(file)
-        full_text = []
-        for slide_number, slide in enumerate(prs.slides):
-            full_text.append(f"\nSlide {slide_number + 1}")
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    full_text.append(shape.text)
-        return "\n".join(full_text)
-    elif file_type == "pdf":
-        text = ""
-        with fitz.open(file, file.read()) as doc:
-            for page in doc:
-                text += page.get_text()
-        return text
-    else:
-        log.error(f"Unsupported file type: {file_type}")
+    data = file.getvalue()
+    cache = get_extraction_cache()
+    text = cache.get_or_extract(data, file_type, lambda: _extract_text(file.name, data, file_type, log))
+    log.debug(f"Extraction cache stats: {cache.stats()}")
+    return text
+
+
+def _extract_text(name, data, file_type, log):
+    """
+    Extract the text from the raw contents of a document.
+
+    Args:
+        name (str): The file name, used for logging.
+        data (bytes): The raw file contents.
+        file_type (str): The file extension.
+
+    Returns:
+        str: The full text extracted from the file.
+    """
+    log.info(f"Reading text from file: {name}")
+    try:
+        return extract_text(data, file_type)
+    except ValueError as e:
+        log.error(e)
         return "Unsupported file type"
 
 
-def todoist_agent_loop(chatbot, user_input, temp, hist_len, max_actions, todoist_api_key):
+def render_stream(deltas):
+    """
+    Render a streamed response as it arrives and return the full text.
+
+    Args:
+        deltas (Iterator[str]): The pieces of the response.
+
+    Returns:
+        str: The full response.
+    """
+    placeholder = st.empty()
+    parts = []
+    for delta in deltas:
+        parts.append(delta)
+        placeholder.markdown("".join(parts) + "▌")
+    placeholder.empty()
+    return "".join(parts).strip()
+
+
+def render_instrumentation():
+    """
+    Show the latency percentiles, tokens, prompt cache hit ratio, bytes and cost of the calls made so far.
+
+    Returns:
+        None
+    """
+    rows = get_instrumentation().summary()
+    if not rows:
+        st.caption("No calls recorded yet.")
+        return
+    st.dataframe([{
+        "kind": row["kind"],
+        "name": row["name"],
+        "calls": row["count"],
+        "errors": row["errors"],
+        "p50 ms": round(row["p50"] * 1000),
+        "p90 ms": round(row["p90"] * 1000),
+        "p99 ms": round(row["p99"] * 1000),
+        "tokens": row["prompt_tokens"] + row["completion_tokens"],
+        "cached %": round(100 * row["cached_tokens"] / row["prompt_tokens"]) if row["prompt_tokens"] else None,
+        "KB": round(row["bytes"] / 1024, 1),
+        "cost $": round(row["cost"], 4),
+    } for row in rows], hide_index=True)
+
+
+def render_rate_limits():
+    """
+    Show the request queue of each rate limiter and how long requests waited per priority.
+
+    Returns:
+        None
+    """
+    for stats in rate_limit_stats():
+        waits = ", ".join(f"{name} {round(row['mean_wait_seconds'] * 1000)} ms"
+                          for name, row in stats["priorities"].items() if row["granted"])
+        paused = f", paused {stats['paused_seconds']:.0f}s" if stats["paused_seconds"] else ""
+        st.caption(f"{stats['name']}: {stats['queue_depth']} queued, {stats['rate_limited']} rate limited"
+                   f"{paused}; mean wait {waits or 'none yet'}")
+
+
+def stream_react_response(chatbot, inputs, temp, hist_len, live=True):
+    """
+    Stream the agent's next response, validating it as soon as its JSON object closes.
+
+    The stream is abandoned once a valid ReactResponse has arrived, so trailing prose
+    after the JSON is neither waited for nor kept in the history.
+
+    Args:
+        chatbot (Chatbot): The chatbot instance.
+        inputs (str): The objective or observation to send.
+        temp (float): The temperature value for generating responses.
+        hist_len (int): The length of chat history to consider.
+        live (bool): Whether to render the partial response while it streams.
+
+    Returns:
+        tuple: The raw response and the parsed ReactResponse, or None if it still needs repair.
+    """
+    placeholder = st.empty() if live else None
+    scanner = JsonObjectScanner()
+    deltas = chatbot.stream('user', inputs, temp, hist_len)
+    response = None
+    try:
+        for delta in deltas:
+            candidate = scanner.feed(delta)
+            if placeholder:
+                placeholder.code(scanner.text, language="json")
+            if candidate is None:
+                continue
+            try:
+                response = ReactResponse.parse_raw(candidate)
+                break
+            except ValueError:
+                continue
+    finally:
+        deltas.close()
+        if placeholder:
+            placeholder.empty()
+    return scanner.text, response
+
+
+def call_react_tool(chatbot, inputs, temp, hist_len, tools):
+    """
+    Ask the agent for its next action as a tool call and validate the arguments.
+
+    Args:
+        chatbot (Chatbot): The chatbot instance.
+        inputs (str): The objective or observation to send.
+        temp (float): The temperature value for generating responses.
+        hist_len (int): The length of chat history to consider.
+        tools (list): The actions as tool definitions.
+
+    Returns:
+        tuple: The response as ReactResponse JSON and the parsed ReactResponse, or None if it still needs repair.
+    """
+    calls, text = chatbot.call_tool('user', inputs, temp, hist_len, tools)
+    # a text answer instead of tool calls goes through the repair pipeline
+    raw_response = react_tool_calls(calls) if calls else text
+    try:
+        return raw_response, ReactResponse.parse_raw(raw_response)
+    except ValueError:
+        return raw_response, None
+
+
+def execute_action(todoist, action):
+    """
+    Perform one action of the agent's plan.
+
+    Task and project lists are returned as compact tables (see todoist_agent.observations).
+
+    Args:
+        todoist (TodoistActionToolKit): The toolkit to act with.
+        action (pydantic.BaseModel): The action to perform; never the final answer.
+
+    Returns:
+        The result of the action.
+
+    Raises:
+        ValueError: If the action fails or is unknown.
+    """
+    match action:
+        case GetAllInboxTasksAction():
+            # the first page of query_tasks, so the agent can continue it with next_offset
+            page = todoist.query_tasks(project_id=todoist.inbox_id, limit=OBSERVATION_MAX_ROWS)
+            return encode_tasks(page["tasks"], page["total"])
+        case GetAllTasksAction():
+            # leaves out the inbox, which no query_tasks offset can reproduce
+            return encode_tasks(todoist.get_all_tasks(), pageable=False)
+        case GetAllProjectsAction():
+            return encode_projects(todoist.get_all_projects())
+        case QueryTasksAction():
+            query = action.dict(exclude={"type"})
+            page = todoist.query_tasks(**query)
+            return encode_tasks(page["tasks"], page["total"], query["offset"])
+        case MoveTaskAction(task_id=task_id, project_id=project_id):
+            todoist.move_task(task_id, project_id)
+            return f"Task with id {task_id} moved to project with id {project_id}."
+        case MoveTasksAction(task_ids=task_ids, project_id=project_id):
+            return todoist.move_tasks(task_ids, project_id)
+        case CreateNewProjectAction(project_name=project_name):
+            return todoist.create_project(project_name)
+        case _:
+            raise ValueError(f"Unknown action {action}")
+
+
+def _observe(todoist, action, sync_error=None):
+    """
+    Perform an action and describe its outcome, reporting a failure instead of raising it.
+
+    A read is not answered from stale data when the sync before it failed; `sync_error` is reported instead.
+
+    Returns:
+        dict: The action type and its result or error.
+    """
+    if sync_error and isinstance(action, READ_ONLY_ACTIONS):
+        return {"action": action.type, "error": sync_error}
+    try:
+        return {"action": action.type, "result": execute_action(todoist, action)}
+    except ValueError as e:
+        return {"action": action.type, "error": str(e)}
+
+
+def execute_actions(todoist, actions):
+    """
+    Perform the actions of a plan and return one observation per action.
+
+    Consecutive read-only actions run concurrently, with the caller's request priority;
+    every other action runs on its own, in order. A failing action is reported in its
+    observation and does not stop the rest.
+
+    Args:
+        todoist (TodoistActionToolKit): The toolkit to act with.
+        actions (list): The actions to perform, without the final answer.
+
+    Returns:
+        list: The observation of each action, in the order of the actions.
+    """
+    # one delta sync serves every read of the plan; the toolkit's own writes patch the snapshot
+    sync_error = None
+    if any(isinstance(action, READ_ONLY_ACTIONS) for action in actions):
+        try:
+            todoist.refresh()
+        except ValueError as e:
+            sync_error = str(e)
+    observations = []
+    with ThreadPoolExecutor(max_workers=READ_ACTION_WORKERS) as pool:
+        i = 0
+        while i < len(actions):
+            j = i + 1
+            if isinstance(actions[i], READ_ONLY_ACTIONS):
+                while j < len(actions) and isinstance(actions[j], READ_ONLY_ACTIONS):
+                    j += 1
+            if j - i > 1:
+                contexts = [contextvars.copy_context() for _ in range(i, j)]
+                observations += pool.map(lambda context, action: context.run(_observe, todoist, action, sync_error),
+                                         contexts, actions[i:j])
+            else:
+                observations.append(_observe(todoist, actions[i], sync_error))
+            i = j
+    return observations
+
+
+def todoist_agent_loop(chatbot, user_input, temp, hist_len, max_actions, todoist_api_key,
+                       toolkit=None, repair_chatbot=None, render=message, live=True, tool_calling=None):
     """
     Executes a loop of actions for a Todoist agent.
 
+    Each turn the agent answers with a plan of one or more actions. The loop stops at
+    the final answer or once max_actions actions, not turns, have been used.
+
     Args:
         chatbot (Chatbot): The chatbot instance.
         user_input (str): The user's input.
@@ -75,49 +328,67 @@ def todoist_agent_loop(chatbot, user_input, temp, hist_len, max_actions, todoist
         hist_len (int): The length of chat history to consider.
         max_actions (int): The maximum number of actions to perform.
         todoist_api_key (str): The API key for Todoist.
+        toolkit (TodoistActionToolKit): The toolkit to act with (default: a new one for todoist_api_key).
+        repair_chatbot (Chatbot): The chatbot used to repair malformed responses (default: a new one).
+        render (callable): Displays a message to the user (default: the streamlit_chat message).
+        live (bool): Whether to render partial responses while they stream.
+        tool_calling (bool): Whether the actions are offered as tools (default: None, if the engine supports it).
 
     Returns:
         None
     """
-    chatbot.set_todoist_prompt(ReactResponse, user_input)
-    todoist = TodoistActionToolKit(todoist_api_key)
+    if tool_calling is None:
+        tool_calling = chatbot.supports_tools()
+    tools = react_tools(ReactResponse) if tool_calling else None
+    chatbot.set_todoist_prompt(ReactResponse, user_input, tools=tool_calling)
+    todoist = toolkit
+    if todoist is None:
+        # the Todoist client is only imported by sessions that use the agent
+        from todoist_agent.todoist_action_toolkit import TodoistActionToolKit
+        todoist = TodoistActionToolKit(todoist_api_key)
 
     inputs = json.dumps({"objective": user_input})
-    for i in range(max_actions):
-        raw_response = chatbot.send('user', inputs, temp, hist_len)
+    actions_used = 0
+    while actions_used < max_actions:
+        if tools:
+            raw_response, response = call_react_tool(chatbot, inputs, temp, hist_len, tools)
+        else:
+            raw_response, response = stream_react_response(chatbot, inputs, temp, hist_len, live)
         try:
-            response = parse_base_model_with_retries(raw_response, ReactResponse)  # noqa
-            message(f"Thought: {response.thought}\n" +
-                    f"\nAction: {response.action.dict()}\n" +
-                    f"\nNumber of actions used: {i + 1}")
-
-            chatbot.messages.append({"role": "assistant", "content": json.dumps(response.dict())})
-
-            match response.action:
-                case GiveFinalAnswerAction():
-                    message(f"Final Answer: {response.action.answer}") # noqa
-                    return
-                case GetAllInboxTasksAction():
-                    observation = todoist.get_inbox_tasks()
-                case GetAllTasksAction():
-                    observation = todoist.get_all_tasks()
-                case GetAllProjectsAction():
-                    observation = todoist.get_all_projects()
-                case MoveTaskAction(task_id=task_id, project_id=project_id):
-                    todoist.move_task(task_id, project_id)
-                    observation = (f"Task with id {task_id} moved to project with id {project_id}.")
-                case CreateNewProjectAction(project_name=project_name):
-                    observation = todoist.create_project(project_name)
-                case _:
-                    raise ValueError(f"Unknown action {response.action}")
+            if response is None:
+                response = parse_base_model_with_retries(raw_response, ReactResponse, chatbot=repair_chatbot)  # noqa
         except ValueError as e:
+            # a turn without a usable plan still counts, so a confused agent cannot loop forever
+            actions_used += 1
             observation = f"You response caused the following error: {e}. Please try again and avoid this error."
             chatbot.messages.append({"role": "assistant", "content": observation})
+            inputs = json.dumps({"observation": observation})
+            continue
 
-        # message(f"Observation: {observation}")
-        inputs = json.dumps({"observation": observation})
+        # the plan is cut at the final answer and at the remaining action budget
+        actions = response.actions[:max_actions - actions_used]
+        final = next((a for a in actions if isinstance(a, GiveFinalAnswerAction)), None)
+        if final is not None:
+            actions = actions[:actions.index(final)]
+        actions_used += len(actions) + (final is not None)
+        render(f"Thought: {response.thought}\n" +
+               "".join(f"\nAction: {action.dict()}\n" for action in actions + ([final] if final else [])) +
+               f"\nNumber of actions used: {actions_used}")
 
-    message("I have used my maximum number of actions. I will now stop.")
+        chatbot.messages.append({"role": "assistant", "content": json.dumps(response.dict())})
+
+        observations = execute_actions(todoist, actions)
+        if final is not None:
+            if not any("error" in observation for observation in observations):
+                render(f"Final Answer: {final.answer}") # noqa
+                return
+            # the answer was written before the results were known, so the agent revisits it
+            observations.append({"action": final.type, "error": "Not given because an earlier action failed."})
+
+        # message(f"Observation: {observations}")
+        inputs = json.dumps({"observation": observations}, separators=(",", ":"))
+
+    render("I have used my maximum number of actions. I will now stop.")
 
 
 def main() -> None:
@@ -127,12 +398,8 @@ def main() -> None:
     Returns:
         None
     """
-    if 'logger' in st.session_state:
-        del st.session_state.logger
-
-    # Set up logging
-    st.session_state.logger = get_logger("main")
-    log = st.session_state.logger
+    # Set up logging; the logger is configured on the first run only
+    log = get_logger("main")
 
     log.info("Starting main function")
 
@@ -175,25 +442,57 @@ def main() -> None:
             welcome = "Ask me about your todo list or what you'd like to add to it."
         else:
             uploaded_files = st.file_uploader("Upload one or more documents to use in your context",
-                                              type=["docx", "pptx", "pdf"], accept_multiple_files=True)
-            st.write("Note: The documents will be used in the system prompt labeled as 'DOCUMENT 0', 'DOCUMENT 1', etc.")  # noqa
+                                              type=supported_file_types(), accept_multiple_files=True)
+            st.write("Note: Only the excerpts most relevant to each request are sent after the conversation, labeled as 'DOCUMENT 0', 'DOCUMENT 1', etc.")  # noqa
+            top_k = st.slider("Select the number of document excerpts per request:", 1, 20, 5)
+            doc_tokens = st.slider("Select the token budget for document excerpts:", 500, 16000, 4000, step=500)
+            cache_stats = get_extraction_cache().stats()
+            st.caption(f"Document cache: {cache_stats['hits'] + cache_stats['disk_hits']} hits, "
+                       f"{cache_stats['misses']} misses")
             welcome = "Ask me anything and I'll do my best."
 
-        if 'chatbot' in st.session_state and gpt_engine_choice != st.session_state.gpt_engine:
-            del st.session_state.chatbot
+        response_stats = get_response_cache().stats()
+        st.caption(f"Response cache: {response_stats['hit_ratio']:.0%} hit ratio, "
+                   f"{response_stats['saved_seconds']:.1f}s saved (used at temperature 0)")
+
+        with st.expander("Performance"):
+            render_instrumentation()
+            render_rate_limits()
 
-    # Create an instance of the ChatBot class only once
+    # Create an instance of the ChatBot class only once; changing the engine keeps the history
     if 'chatbot' not in st.session_state:
-        st.session_state.gpt_engine = gpt_engine_choice
-        st.session_state.chatbot = ChatBot(openai_api_key, gpt_engine_choice)
+        st.session_state.chatbot = ChatBot(openai_api_key, gpt_engine_choice, get_response_cache())
 
     # Get the instance of the ChatBot class
     chatbot = st.session_state.chatbot
+    chatbot.gpt_engine = gpt_engine_choice
+
+    # keep this session within its memory budget and move idle sessions to disk
+    session_id = get_script_run_ctx().session_id
+    sessions = get_session_manager()
+    sessions.touch(session_id, chatbot)
+    session_stats, process_stats = sessions.session_stats(session_id), sessions.stats()
+    st.sidebar.caption(f"Session memory: {session_stats['bytes'] / 1024:.0f} KB of "
+                       f"{session_stats['budget'] / 1024:.0f} KB; {process_stats['sessions']} sessions using "
+                       f"{process_stats['bytes'] / 1024:.0f} KB, {process_stats['spilled']} spilled to disk")
+
+    # the conversation id lives in the URL, so a reload or a server restart reopens the stored conversation
+    history = get_history_store()
+    conversation_id = st.query_params.get("conversation")
+    if not conversation_id:
+        conversation_id = new_conversation_id()
+        st.query_params["conversation"] = conversation_id
+    if st.session_state.get("conversation_id") != conversation_id:
+        chatbot.reset_history()
+        chatbot.messages[1:] = history.recent(conversation_id, HISTORY_CONTEXT_TURNS)
+        st.session_state.conversation_id = conversation_id
+        st.session_state.history_pages = 1
 
     # Set the system prompt
     ext_prompt = "\nFollow the user's requirements carefully and to the letter."
-    for x in range(0, len(uploaded_files)):
-        ext_prompt = ext_prompt + f"\nDOCUMENT {x}: {read_text_from_file(uploaded_files[x], log)}"
+    documents = [read_text_from_file(file, log) for file in uploaded_files]
+    if documents:
+        ext_prompt += "\nExcerpts of the user's documents relevant to the request are provided after the conversation."
     chatbot.set_system_prompt(content_type, ext_prompt)
 
     # Allow the user to update the prompt
@@ -203,26 +502,46 @@ def main() -> None:
                               height=200)
         chatbot.set_system_prompt(content_type, prompt)
 
-    # Display the chat history or welcome message
+    # Display the welcome message and the newest pages of the stored conversation
     message(f"Hello Human! {welcome}", is_user=False)
-    for msg in chatbot.messages[1:]:
+    shown = HISTORY_PAGE_SIZE * st.session_state.history_pages
+    if history.count(conversation_id) > shown and st.button("Load older messages"):
+        st.session_state.history_pages += 1
+        shown += HISTORY_PAGE_SIZE
+    for msg in history.recent(conversation_id, shown):
         is_user = True if msg["role"] == "user" else False
         message(msg["content"], is_user)
 
     user_input = st.chat_input("Type your request here ...")
     if user_input:
-        message(user_input, is_user=True)
-        with st.spinner("Thinking..."):
+        # a session is not spilled to disk while its request runs
+        with sessions.working(session_id):
+            message(user_input, is_user=True)
             if content_type == "todoist":
-                todoist_agent_loop(chatbot, user_input, temp, hist_len, max_actions, todoist_api_key)
-                # clear the chat history after each iteration
-                chatbot.messages = chatbot.messages[:1]
+                # queued behind chat requests of other sessions that share the API keys
+                with st.spinner("Thinking..."), request_priority("agent"):
+                    todoist_agent_loop(chatbot, user_input, temp, hist_len, max_actions, todoist_api_key)
+                # clear the agent's turns after each iteration; the model goes back to remembering
+                # the stored conversation the page shows
+                chatbot.reset_history()
+                chatbot.messages[1:] = history.recent(conversation_id, HISTORY_CONTEXT_TURNS)
             else:
-                message(chatbot.send("user", user_input, temp, hist_len), is_user=False)
+                doc_context = ""
+                if documents:
+                    doc_index = get_document_index(documents)
+                    doc_context = doc_index.format_context(user_input, top_k, doc_tokens, gpt_engine_choice)
+                chatbot.set_context(doc_context)
+                # only the new turn is written; earlier turns are already stored
+                history.append(conversation_id, "user", user_input)
+                response = render_stream(chatbot.stream("user", user_input, temp, hist_len))
+                history.append(conversation_id, "assistant", response)
+                message(response, is_user=False)
     st.write(f"History Depth: {str(chatbot.messages.__len__())}")
 
     if st.button("Clear"):
-        chatbot.messages = chatbot.messages[:1]
+        chatbot.reset_history()
+        # the stored conversation is kept; clearing starts a new one
+        st.query_params["conversation"] = new_conversation_id()
         # Refresh the page to show changes
         st.rerun()
 
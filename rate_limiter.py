@@ -0,0 +1,434 @@
+import asyncio
+import bisect
+import contextvars
+import hashlib
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from instrumentation import get_instrumentation
+
+OPENAI_RPM = float(os.environ.get('OPENAI_RPM', 500))
+# tokens per minute; 0 until the API reports its limit in the response headers
+OPENAI_TPM = float(os.environ.get('OPENAI_TPM', 0))
+# Todoist allows 450 requests per user in any 15 minutes: a burst of 450, refilled at 30 a minute
+TODOIST_RPM = float(os.environ.get('TODOIST_RPM', 30))
+TODOIST_BURST = float(os.environ.get('TODOIST_BURST', 450))
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get('RATE_LIMIT_MAX_RETRIES', 5))
+RATE_LIMIT_BACKOFF = float(os.environ.get('RATE_LIMIT_BACKOFF', 1.0))
+RATE_LIMIT_MAX_BACKOFF = float(os.environ.get('RATE_LIMIT_MAX_BACKOFF', 60.0))
+
+# lower numbers go first: a waiting chat request is served before queued agent or batch requests
+PRIORITIES = {'interactive': 0, 'agent': 1, 'batch': 2}
+
+_priority = contextvars.ContextVar('request_priority', default='interactive')
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+@contextmanager
+def request_priority(name):
+    '''
+    Sets the priority of the requests made in the enclosed block.
+
+    The priority is a context variable, so it follows the code into coroutines run with
+    clients.run_sync or clients.submit, but threads started inside the block need the
+    context copied explicitly (contextvars.copy_context().run).
+
+    Args:
+        name (str): "interactive", "agent" or "batch".
+    '''
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority {name}, expected one of {', '.join(PRIORITIES)}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    '''
+    Returns the priority of requests made from the current context.
+
+    Returns:
+        str: "interactive" unless request_priority says otherwise.
+    '''
+    return _priority.get()
+
+
+def parse_duration(value) -> float | None:
+    '''
+    Parses a duration as sent in rate limit headers, e.g. "20ms", "1s", "6m0s" or "2.5".
+
+    Args:
+        value (str): The header value.
+
+    Returns:
+        float: The duration in seconds, or None if the value cannot be parsed.
+    '''
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class _TokenBucket:
+    def __init__(self, per_minute, burst=None):
+        self.capacity = burst or per_minute
+        self.rate = per_minute / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # a request larger than the bucket waits for a full bucket rather than forever
+        needed = min(amount, self.capacity) - self.level
+        return needed / self.rate if needed > 0 else 0.0
+
+
+class RateLimiter:
+    '''
+    Schedules the requests to one provider and API key within its rate limits.
+
+    Requests wait in a priority queue and are released by token buckets for requests
+    and, where known, tokens per minute. Only the first request in line is awake,
+    sleeping until the buckets allow it; the others sleep until they reach the front.
+    The buckets follow the remaining-request and remaining-token headers of the
+    responses. A 429 pauses every request of the key for the server's Retry-After or
+    a jittered exponential backoff, so one busy session backs off for all of them
+    instead of failing their requests.
+
+    Attributes:
+        name (str): The provider, e.g. "openai".
+        max_retries (int): How often a rate limited request is retried.
+    '''
+
+    def __init__(self, name, requests_per_minute, tokens_per_minute=0, burst=None,
+                 max_retries=RATE_LIMIT_MAX_RETRIES):
+        '''
+        Initializes a RateLimiter instance.
+
+        Args:
+            name (str): The provider, used in metrics.
+            requests_per_minute (float): The request budget.
+            tokens_per_minute (float): The token budget, or 0 until a response reports it.
+            burst (float): The requests that may be sent at once (default: None, a minute's worth).
+            max_retries (int): How often a rate limited request is retried.
+        '''
+        self.name = name
+        self.max_retries = max_retries
+        self._requests = _TokenBucket(requests_per_minute, burst)
+        self._tokens = _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._paused_until = 0.0
+        self._queue = []
+        # wakes the waiter holding each ticket
+        self._wakers = {}
+        self._tickets = itertools.count()
+        self._lock = threading.Lock()
+        self._metrics = {name: {'granted': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0} for name in PRIORITIES}
+        self.rate_limited = 0
+
+    def _enqueue(self, priority, waker):
+        ticket = (PRIORITIES[priority], next(self._tickets))
+        with self._lock:
+            bisect.insort(self._queue, ticket)
+            self._wakers[ticket] = waker
+        return ticket
+
+    def _dequeue(self, ticket):
+        with self._lock:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+            del self._wakers[ticket]
+            self._wake_head()
+
+    def _wake_head(self):
+        # called with the lock held
+        if self._queue:
+            self._wakers[self._queue[0]]()
+
+    def _try_acquire(self, ticket, tokens) -> float | None:
+        '''
+        Takes capacity for the request if it is first in line and the buckets allow it.
+
+        Returns:
+            float: 0 if the request may go, how long to wait before trying again if it is
+            first in line, or None to wait until it is woken.
+        '''
+        with self._lock:
+            if self._queue[0] != ticket:
+                return None
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._requests.refill(now)
+            wait = self._requests.wait_time(1)
+            if self._tokens is not None:
+                self._tokens.refill(now)
+                wait = max(wait, self._tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+            self._requests.level -= 1
+            if self._tokens is not None:
+                self._tokens.level -= tokens
+            self._queue.pop(0)
+            return 0.0
+
+    def _granted(self, priority, waited):
+        with self._lock:
+            metrics = self._metrics[priority]
+            metrics['granted'] += 1
+            metrics['wait_seconds'] += waited
+            metrics['max_wait_seconds'] = max(metrics['max_wait_seconds'], waited)
+        get_instrumentation().record({'kind': 'rate_limit_wait', 'name': f'{self.name}:{priority}'}, waited)
+
+    def acquire(self, tokens=0, priority=None) -> float:
+        '''
+        Blocks until a request may be sent.
+
+        Args:
+            tokens (int): The estimated tokens of the request.
+            priority (str): The priority (default: None, the current request_priority).
+
+        Returns:
+            float: How long the request waited in seconds.
+        '''
+        priority = priority or current_priority()
+        wake = threading.Event()
+        ticket = self._enqueue(priority, wake.set)
+        start = time.monotonic()
+        try:
+            while True:
+                # cleared before checking, so a wake-up between the check and the wait is kept
+                wake.clear()
+                wait = self._try_acquire(ticket, tokens)
+                if wait == 0:
+                    break
+                wake.wait(wait)
+        finally:
+            self._dequeue(ticket)
+        waited = time.monotonic() - start
+        self._granted(priority, waited)
+        return waited
+
+    async def aacquire(self, tokens=0, priority=None) -> float:
+        '''
+        Waits until a request may be sent, without blocking the event loop.
+
+        Args:
+            tokens (int): The estimated tokens of the request.
+            priority (str): The priority (default: None, the current request_priority).
+
+        Returns:
+            float: How long the request waited in seconds.
+        '''
+        priority = priority or current_priority()
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        ticket = self._enqueue(priority, lambda: loop.call_soon_threadsafe(wake.set))
+        start = time.monotonic()
+        try:
+            while True:
+                wake.clear()
+                wait = self._try_acquire(ticket, tokens)
+                if wait == 0:
+                    break
+                try:
+                    await asyncio.wait_for(wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._dequeue(ticket)
+        waited = time.monotonic() - start
+        self._granted(priority, waited)
+        return waited
+
+    def update_from_headers(self, headers):
+        '''
+        Adjusts the buckets to the limits and remaining budget the provider reports.
+
+        Reads the x-ratelimit-limit-*, x-ratelimit-remaining-* and x-ratelimit-reset-*
+        headers for requests and tokens, as sent by OpenAI.
+
+        Args:
+            headers (Mapping): The response headers.
+        '''
+        with self._lock:
+            for kind in ('requests', 'tokens'):
+                limit = headers.get(f'x-ratelimit-limit-{kind}')
+                remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+                if limit is None and remaining is None:
+                    continue
+                bucket = self._requests if kind == 'requests' else self._tokens
+                if bucket is None:
+                    if limit is None:
+                        continue
+                    bucket = self._tokens = _TokenBucket(float(limit))
+                if limit is not None and float(limit) != bucket.capacity:
+                    bucket.capacity = float(limit)
+                    bucket.rate = bucket.capacity / 60
+                if remaining is not None:
+                    bucket.level = min(bucket.level, float(remaining))
+                    reset = parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+                    if float(remaining) <= 0 and reset:
+                        self._paused_until = max(self._paused_until, time.monotonic() + reset)
+            # a raised limit may let the first request go sooner than it planned
+            self._wake_head()
+
+    def on_rate_limited(self, headers, attempt) -> float:
+        '''
+        Pauses all requests of this key after a 429 response.
+
+        Args:
+            headers (Mapping): The headers of the 429 response.
+            attempt (int): How many times the request was already retried.
+
+        Returns:
+            float: The pause in seconds.
+        '''
+        delay = parse_duration(headers.get('retry-after-ms'))
+        delay = delay / 1000 if delay is not None else parse_duration(headers.get('retry-after'))
+        if delay is None:
+            delay = min(RATE_LIMIT_MAX_BACKOFF, RATE_LIMIT_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.5)
+        with self._lock:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def stats(self) -> dict:
+        '''
+        Returns the scheduling metrics.
+
+        Returns:
+            dict: The queue depth, the 429s received, how long the limiter is still paused,
+            and per priority the granted requests and their mean and maximum wait.
+        '''
+        with self._lock:
+            priorities = {}
+            for name, metrics in self._metrics.items():
+                granted = metrics['granted']
+                priorities[name] = {
+                    'granted': granted,
+                    'waiting': sum(1 for ticket in self._queue if ticket[0] == PRIORITIES[name]),
+                    'mean_wait_seconds': metrics['wait_seconds'] / granted if granted else 0.0,
+                    'max_wait_seconds': metrics['max_wait_seconds'],
+                }
+            return {
+                'name': self.name,
+                'queue_depth': len(self._queue),
+                'rate_limited': self.rate_limited,
+                'paused_seconds': max(0.0, self._paused_until - time.monotonic()),
+                'priorities': priorities,
+            }
+
+
+def _request_tokens(request: httpx.Request) -> int:
+    # about four bytes of JSON per token is close enough to budget the request
+    try:
+        return len(request.content) // 4
+    except httpx.RequestNotRead:
+        return 0
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    '''
+    An httpx transport that sends each request through a RateLimiter and retries 429s.
+    '''
+
+    def __init__(self, transport: httpx.BaseTransport, limiter: RateLimiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        for attempt in range(self.limiter.max_retries + 1):
+            self.limiter.acquire(_request_tokens(request))
+            response = self.transport.handle_request(request)
+            self.limiter.update_from_headers(response.headers)
+            if response.status_code != 429 or attempt == self.limiter.max_retries:
+                return response
+            response.close()
+            # the pause holds back the retry, and every other request of the key, in acquire
+            self.limiter.on_rate_limited(response.headers, attempt)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    '''
+    The asynchronous version of RateLimitedTransport.
+    '''
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, limiter: RateLimiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        for attempt in range(self.limiter.max_retries + 1):
+            await self.limiter.aacquire(_request_tokens(request))
+            response = await self.transport.handle_async_request(request)
+            self.limiter.update_from_headers(response.headers)
+            if response.status_code != 429 or attempt == self.limiter.max_retries:
+                return response
+            await response.aclose()
+            self.limiter.on_rate_limited(response.headers, attempt)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+_DEFAULT_LIMITS = {
+    'openai': lambda: (OPENAI_RPM, OPENAI_TPM, None),
+    'todoist': lambda: (TODOIST_RPM, 0, TODOIST_BURST),
+}
+
+
+def get_rate_limiter(provider, api_key) -> RateLimiter:
+    '''
+    Returns the process-wide rate limiter for a provider and API key.
+
+    Args:
+        provider (str): "openai" or "todoist".
+        api_key (str): The API key; each key has its own limits.
+
+    Returns:
+        RateLimiter: The shared limiter.
+    '''
+    key = (provider, hashlib.sha256((api_key or '').encode()).hexdigest()[:16])
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(provider, *_DEFAULT_LIMITS[provider]())
+        return _limiters[key]
+
+
+def rate_limit_stats() -> list[dict]:
+    '''
+    Returns the metrics of every rate limiter in the process.
+
+    Returns:
+        list: The stats of each limiter.
+    '''
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.stats() for limiter in limiters]
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH', 'logs/response_cache.sqlite')
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 7 * 24 * 3600))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+
+class ResponseCache:
+    '''
+    A persistent cache of chat completions backed by SQLite.
+
+    Entries expire after a TTL, and the least recently used entries are evicted once
+    the stored responses exceed the size budget.
+
+    Attributes:
+        hits (int): The number of lookups served from the cache.
+        misses (int): The number of lookups that needed an API call.
+        saved_seconds (float): The API latency avoided by the hits.
+    '''
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        '''
+        Initializes a ResponseCache instance.
+
+        Args:
+            path (str): The SQLite database file, or ":memory:".
+            ttl (float): The lifetime of an entry in seconds.
+            max_bytes (int): The budget for the stored responses.
+        '''
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, latency REAL NOT NULL, "
+            "size INTEGER NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+
+    @staticmethod
+    def key(model, messages, temperature):
+        '''
+        Builds a stable key for a completion request.
+
+        Args:
+            model (str): The model name.
+            messages (list): The messages sent, after trimming to the context window.
+            temperature (float): The sampling temperature.
+
+        Returns:
+            str: The hex digest identifying the request.
+        '''
+        payload = json.dumps([model, messages, temperature], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        '''
+        Looks up a cached response.
+
+        Args:
+            key (str): The key returned by `key`.
+
+        Returns:
+            str: The cached response, or None on a miss.
+        '''
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, latency FROM responses WHERE key = ? AND expires_at > ?",
+                                   (key, now)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self.saved_seconds += row[1]
+            return row[0]
+
+    def put(self, key, response, latency):
+        '''
+        Stores a response and evicts expired or excess entries.
+
+        Args:
+            key (str): The key returned by `key`.
+            response (str): The response from the model.
+            latency (float): How long the API call took, in seconds.
+        '''
+        now = time.time()
+        size = len(response.encode())
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, response, latency, size, now + self.ttl, now))
+            self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                # drop the least recently used entries until the total fits the budget again
+                rows = self._db.execute("SELECT key, size FROM responses ORDER BY used_at").fetchall()
+                evicted = []
+                for row_key, row_size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((row_key,))
+                    total -= row_size
+                self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self):
+        '''
+        Returns the hit ratio and the latency saved so far.
+
+        Returns:
+            dict: The cache statistics.
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    '''
+    Returns the process-wide response cache.
+
+    Returns:
+        ResponseCache: The shared cache instance.
+    '''
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
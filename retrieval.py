@@ -0,0 +1,167 @@
+import hashlib
+import math
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+from tokenizer import count_tokens
+
+CHUNK_WORDS = 200
+INDEX_CACHE_SIZE = 32
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TERM_RE = re.compile(r"\w+")
+
+
+def _terms(text) -> list[str]:
+    return _TERM_RE.findall(text.lower())
+
+
+def chunk_text(text, chunk_words=CHUNK_WORDS) -> list[str]:
+    '''
+    Splits text into chunks of roughly `chunk_words` words along line boundaries.
+
+    Args:
+        text (str): The text to split.
+        chunk_words (int): The target number of words per chunk.
+
+    Returns:
+        list: The non-empty chunks in document order.
+    '''
+    chunks = []
+    lines = []
+    words = 0
+    for line in text.splitlines():
+        line_words = line.split()
+        # lines longer than a chunk are split on word boundaries
+        while len(line_words) > chunk_words:
+            chunks.append(" ".join(line_words[:chunk_words]))
+            line_words = line_words[chunk_words:]
+        lines.append(" ".join(line_words))
+        words += len(line_words)
+        if words >= chunk_words:
+            chunks.append("\n".join(lines).strip())
+            lines = []
+            words = 0
+    chunks.append("\n".join(lines).strip())
+    return [chunk for chunk in chunks if chunk]
+
+
+class DocumentIndex:
+    '''
+    A local BM25 index over chunks of one or more documents.
+
+    Attributes:
+        chunks (list): The (document number, chunk text) pairs in document order.
+    '''
+
+    def __init__(self, documents, chunk_words=CHUNK_WORDS):
+        '''
+        Chunks the documents and builds the inverted index.
+
+        Args:
+            documents (list): The extracted text of each document.
+            chunk_words (int): The target number of words per chunk.
+        '''
+        self.chunks = []
+        self._postings = defaultdict(list)
+        self._lengths = []
+        for doc_number, text in enumerate(documents):
+            for chunk in chunk_text(text, chunk_words):
+                chunk_id = len(self.chunks)
+                self.chunks.append((doc_number, chunk))
+                terms = _terms(chunk)
+                self._lengths.append(len(terms))
+                for term, tf in Counter(terms).items():
+                    self._postings[term].append((chunk_id, tf))
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        self._idf = {
+            term: math.log(1 + (len(self.chunks) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def search(self, query, top_k) -> list[int]:
+        '''
+        Ranks the chunks against a query.
+
+        Args:
+            query (str): The user's message.
+            top_k (int): The maximum number of chunks to return.
+
+        Returns:
+            list: The ids of the best matching chunks, best first. If nothing matches,
+            the first chunks of the documents are returned instead.
+        '''
+        scores = defaultdict(float)
+        for term in set(_terms(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for chunk_id, tf in self._postings[term]:
+                norm = 1 - BM25_B + BM25_B * self._lengths[chunk_id] / self._avg_length
+                scores[chunk_id] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+
+        if not scores:
+            return list(range(min(top_k, len(self.chunks))))
+        return sorted(scores, key=scores.get, reverse=True)[:top_k]
+
+    def format_context(self, query, top_k, max_tokens, model=None) -> str:
+        '''
+        Builds the document excerpts to send with the request for a query.
+
+        Args:
+            query (str): The user's message.
+            top_k (int): The maximum number of excerpts.
+            max_tokens (int): The token budget for all excerpts together.
+            model (str): The model whose encoding is used to count tokens.
+
+        Returns:
+            str: The excerpts labeled by document, or an empty string if there are none.
+        '''
+        context = []
+        budget = max_tokens
+        for chunk_id in self.search(query, top_k):
+            doc_number, chunk = self.chunks[chunk_id]
+            excerpt = f"\nDOCUMENT {doc_number}, EXCERPT {chunk_id}: {chunk}"
+            tokens = count_tokens(excerpt, model)
+            if tokens > budget:
+                continue
+            context.append(excerpt)
+            budget -= tokens
+        return "".join(context)
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_document_index(documents) -> DocumentIndex:
+    '''
+    Returns the index for a set of documents, building it only on first use.
+
+    Indexes are kept in a small process-wide LRU keyed by a hash of the documents,
+    so repeat queries against the same uploads never rebuild the index.
+
+    Args:
+        documents (list): The extracted text of each document.
+
+    Returns:
+        DocumentIndex: The index over the documents.
+    '''
+    digest = hashlib.sha256()
+    for text in documents:
+        digest.update(hashlib.sha256(text.encode()).digest())
+    key = digest.hexdigest()
+
+    with _indexes_lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key]
+
+    index = DocumentIndex(documents)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
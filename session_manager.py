@@ -0,0 +1,270 @@
+import json
+import os
+import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
+import openai
+
+from logger import get_logger
+
+# memory one session's chat history may use before its oldest turns are folded into the summary
+SESSION_MEMORY_BYTES = int(os.environ.get('SESSION_MEMORY_BYTES', 2 * 1024 * 1024))
+# sessions without a rerun for this long have their history moved to disk until they return
+SESSION_IDLE_SECONDS = float(os.environ.get('SESSION_IDLE_SECONDS', 30 * 60))
+SESSION_SPILL_DIR = os.environ.get('SESSION_SPILL_DIR', 'logs/sessions')
+# how often a rerun looks for idle sessions
+SESSION_SWEEP_INTERVAL = 60.0
+
+log = get_logger(__name__)
+
+
+def footprint(chatbot) -> int:
+    '''
+    Estimates the memory held by a chatbot's history.
+
+    Args:
+        chatbot (ChatBot): The chatbot.
+
+    Returns:
+        int: The approximate size in bytes of its messages and summary.
+    '''
+    size = sys.getsizeof(chatbot.messages) + sys.getsizeof(chatbot.window.summary)
+    for message in chatbot.messages:
+        if isinstance(message, dict):
+            size += sys.getsizeof(message) + sum(sys.getsizeof(value) for value in message.values())
+    return size
+
+
+class _Session:
+    def __init__(self, chatbot):
+        self.chatbot = weakref.ref(chatbot)
+        self.last_seen = time.monotonic()
+        self.spill_path = None
+        self.trimmed = 0
+        # requests in progress; a working session is never spilled
+        self.working = 0
+
+
+class SessionManager:
+    '''
+    Bounds the memory the chat sessions of the process hold.
+
+    The OpenAI clients, extraction cache and document indexes are already shared by every
+    session; what remains per session is its ChatBot's history. Each session is kept within
+    a memory budget by folding its oldest turns into the chat summary, and the history of a
+    session that has been idle for a while is written to disk and read back when the session
+    returns. Sessions are held weakly, so a closed browser tab frees its ChatBot and its
+    spill file.
+
+    Attributes:
+        max_bytes (int): The memory budget of one session.
+        idle_seconds (float): The idle time after which a session's history is spilled.
+        spill_dir (Path): Where spilled histories are written.
+    '''
+
+    def __init__(self, max_bytes=SESSION_MEMORY_BYTES, idle_seconds=SESSION_IDLE_SECONDS,
+                 spill_dir=SESSION_SPILL_DIR):
+        '''
+        Initializes a SessionManager instance.
+
+        Args:
+            max_bytes (int): The memory budget of one session.
+            idle_seconds (float): The idle time after which a session's history is spilled.
+            spill_dir (str): Where spilled histories are written.
+        '''
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.spill_dir = Path(spill_dir)
+        self._sessions = {}
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+
+    def touch(self, session_id, chatbot):
+        '''
+        Marks a session as active at the start of its rerun.
+
+        Restores the session's history if it was spilled, trims it to the memory budget
+        and, at most once per sweep interval, spills the sessions that went idle.
+
+        Args:
+            session_id (str): The Streamlit session id.
+            chatbot (ChatBot): The session's chatbot.
+        '''
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.chatbot() is not chatbot:
+                session = self._sessions[session_id] = _Session(chatbot)
+                weakref.finalize(chatbot, self._forget, session_id, session)
+            session.last_seen = time.monotonic()
+            sweep = session.last_seen - self._last_sweep >= SESSION_SWEEP_INTERVAL
+            if sweep:
+                self._last_sweep = session.last_seen
+        if session.spill_path:
+            self._restore(session)
+        self.trim(session_id, chatbot)
+        if sweep:
+            self.sweep()
+
+    @contextmanager
+    def working(self, session_id):
+        '''
+        Marks a session as busy for the enclosed block, e.g. an agent run.
+
+        A busy session is not spilled however long the block takes, and its idle time
+        starts again when the block ends.
+
+        Args:
+            session_id (str): The Streamlit session id.
+        '''
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session:
+                session.working += 1
+        try:
+            yield
+        finally:
+            if session:
+                with self._lock:
+                    session.working -= 1
+                    session.last_seen = time.monotonic()
+
+    def trim(self, session_id, chatbot) -> int:
+        '''
+        Folds the oldest turns of a chat history into its summary until it fits the memory budget.
+
+        The system prompt and the newest turn are always kept. If the summary cannot be
+        written, the turns are dropped instead, so the budget holds either way.
+
+        Args:
+            session_id (str): The Streamlit session id.
+            chatbot (ChatBot): The session's chatbot.
+
+        Returns:
+            int: The number of turns folded.
+        '''
+        count = 0
+        size = footprint(chatbot)
+        while size > self.max_bytes and count < len(chatbot.messages) - 2:
+            message = chatbot.messages[1 + count]
+            size -= sys.getsizeof(message) + sum(sys.getsizeof(value) for value in message.values())
+            count += 1
+        if not count:
+            return 0
+        try:
+            chatbot.fold(count)
+            log.info(f"Folded the {count} oldest turns of session {session_id} into its summary to stay "
+                     f"within {self.max_bytes} bytes.")
+        except openai.OpenAIError as e:
+            log.warning(f"Could not summarize the {count} oldest turns of session {session_id}, dropping them: {e}")
+            del chatbot.messages[1:1 + count]
+        with self._lock:
+            if session_id in self._sessions:
+                self._sessions[session_id].trimmed += count
+        return count
+
+    def sweep(self) -> int:
+        '''
+        Spills the history of every session idle for longer than idle_seconds and not working.
+
+        Returns:
+            int: The number of sessions spilled.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            idle = [(session_id, session) for session_id, session in self._sessions.items()
+                    if session.spill_path is None and not session.working
+                    and now - session.last_seen > self.idle_seconds]
+        spilled = 0
+        for session_id, session in idle:
+            chatbot = session.chatbot()
+            if chatbot is not None and len(chatbot.messages) > 1:
+                self._spill(session_id, session, chatbot)
+                spilled += 1
+        return spilled
+
+    def _spill(self, session_id, session, chatbot):
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spill_dir / f'{session_id}.json'
+        path.write_text(json.dumps({'messages': chatbot.messages[1:], 'summary': chatbot.window.summary}))
+        # the system prompt is rebuilt on every rerun, so only the turns need to come back
+        chatbot.messages = chatbot.messages[:1]
+        chatbot.window.summary = ""
+        session.spill_path = path
+        log.debug(f"Spilled idle session {session_id} to {path}")
+
+    def _restore(self, session):
+        chatbot = session.chatbot()
+        path, session.spill_path = session.spill_path, None
+        try:
+            state = json.loads(path.read_text())
+        except (FileNotFoundError, ValueError) as e:
+            log.warning(f"Could not restore the spilled history {path}: {e}")
+            return
+        chatbot.messages[1:] = state['messages']
+        chatbot.window.summary = state['summary']
+        path.unlink(missing_ok=True)
+
+    def _forget(self, session_id, session):
+        with self._lock:
+            if self._sessions.get(session_id) is session:
+                del self._sessions[session_id]
+        if session.spill_path:
+            session.spill_path.unlink(missing_ok=True)
+
+    def session_stats(self, session_id) -> dict:
+        '''
+        Returns the memory footprint of one session.
+
+        Args:
+            session_id (str): The Streamlit session id.
+
+        Returns:
+            dict: The session's "bytes", the "budget", whether it is "spilled" and the turns "trimmed" so far.
+        '''
+        with self._lock:
+            session = self._sessions.get(session_id)
+        chatbot = session.chatbot() if session else None
+        return {
+            'bytes': footprint(chatbot) if chatbot is not None else 0,
+            'budget': self.max_bytes,
+            'spilled': bool(session and session.spill_path),
+            'trimmed': session.trimmed if session else 0,
+        }
+
+    def stats(self) -> dict:
+        '''
+        Returns the memory footprint of all sessions in the process.
+
+        Returns:
+            dict: The number of "sessions", how many are "spilled" and the total "bytes" in memory.
+        '''
+        with self._lock:
+            sessions = list(self._sessions.values())
+        chatbots = [session.chatbot() for session in sessions]
+        return {
+            'sessions': len(sessions),
+            'spilled': sum(1 for session in sessions if session.spill_path),
+            'bytes': sum(footprint(chatbot) for chatbot in chatbots if chatbot is not None),
+        }
+
+
+_session_manager = None
+_session_manager_lock = threading.Lock()
+
+
+def get_session_manager() -> SessionManager:
+    '''
+    Returns the process-wide session manager.
+
+    Returns:
+        SessionManager: The shared instance.
+    '''
+    global _session_manager
+    with _session_manager_lock:
+        if _session_manager is None:
+            _session_manager = SessionManager()
+        return _session_manager
@@ -1,4 +1,6 @@
-from typing import Literal, Union
+import json
+from functools import lru_cache
+from typing import Annotated, Any, Literal, Union, get_args
 import pydantic as pydantic
 
 
@@ -20,6 +22,42 @@ class GetAllProjectsAction(pydantic.BaseModel):
     type: Literal["get_all_projects"]
 
 
+class QueryTasksAction(pydantic.BaseModel):
+    """Use this to look up open tasks page by page, filtered by project, text or age. Prefer it on large todo lists."""
+
+    type: Literal["query_tasks"]
+    project_id: str | None = pydantic.Field(
+        default=None,
+        description="Only tasks in this project, e.g. the inbox. The project id is obtained from the get_all_projects action.", # noqa
+        pattern=r"^[0-9]+$",
+    )
+    text: str | None = pydantic.Field(
+        default=None,
+        description="Only tasks whose name contains this text, ignoring case.",
+    )
+    older_than_days: int | None = pydantic.Field(
+        default=None,
+        description="Only tasks created more than this many days ago.",
+        ge=0,
+    )
+    newer_than_days: int | None = pydantic.Field(
+        default=None,
+        description="Only tasks created less than this many days ago.",
+        ge=0,
+    )
+    limit: int = pydantic.Field(
+        default=50,
+        description="The maximum number of tasks to return.",
+        ge=1,
+        le=200,
+    )
+    offset: int = pydantic.Field(
+        default=0,
+        description="The number of matching tasks to skip, e.g. the next_offset of the previous page.",
+        ge=0,
+    )
+
+
 class MoveTaskAction(pydantic.BaseModel):
     """Use this to move a task to a project."""
 
@@ -35,6 +73,21 @@ class MoveTaskAction(pydantic.BaseModel):
     )
 
 
+class MoveTasksAction(pydantic.BaseModel):
+    """Use this to move several tasks to the same project in one step."""
+
+    type: Literal["move_tasks"]
+    task_ids: list[Annotated[str, pydantic.StringConstraints(pattern=r"^[0-9]+$")]] = pydantic.Field(
+        description="The task ids obtained from the"
+        + " get_all_tasks or get_all_inbox_tasks action.",
+        min_length=1,
+    )
+    project_id: str = pydantic.Field(
+        description="The project id obtained from the " + "get_all_projects action.", # noqa
+        pattern=r"^[0-9]+$",
+    )
+
+
 class GiveFinalAnswerAction(pydantic.BaseModel):
     """Use this to give the final answer. Only use it when your work is done.""" # noqa
 
@@ -55,19 +108,78 @@ class CreateNewProjectAction(pydantic.BaseModel):
     )
 
 
+Action = Union[
+    GetAllTasksAction,
+    GetAllProjectsAction,
+    CreateNewProjectAction,
+    GetAllInboxTasksAction,
+    QueryTasksAction,
+    MoveTaskAction,
+    MoveTasksAction,
+    GiveFinalAnswerAction,
+]
+
+# actions without side effects, which may run concurrently
+READ_ONLY_ACTIONS = (GetAllTasksAction, GetAllInboxTasksAction, GetAllProjectsAction, QueryTasksAction)
+
+
 class ReactResponse(pydantic.BaseModel):
     """The expected response from the agent."""
 
     thought: str = pydantic.Field(
         description="Here you write your plan to answer the question. You can also write here your interpretation of the observations and progress you have made so far." # noqa
     )
-    action: Union[
-        GetAllTasksAction,
-        GetAllProjectsAction,
-        CreateNewProjectAction,
-        GetAllInboxTasksAction,
-        MoveTaskAction,
-        GiveFinalAnswerAction,
-    ] = pydantic.Field(
-        description="The next action you want to take. Make sure it is consistent with your thoughts." # noqa
+    actions: list[Action] = pydantic.Field(
+        description="The next actions you want to take, in order. Plan several at once when they do not depend on each other's results. Make sure they are consistent with your thoughts.", # noqa
+        min_length=1,
     )
+
+    @pydantic.model_validator(mode="before")
+    @classmethod
+    def _single_action(cls, data: Any) -> Any:
+        """Accept the older single "action" form."""
+        if isinstance(data, dict) and "action" in data and "actions" not in data:
+            data = {key: value for key, value in data.items() if key != "action"} | {"actions": [data["action"]]}
+        return data
+
+
+@lru_cache(maxsize=None)
+def react_tools(react_model: type[pydantic.BaseModel]) -> list[dict[str, Any]]:
+    """Turn each action of the react model into a tool whose arguments are the thought and the action fields."""
+    thought = react_model.model_json_schema()["properties"]["thought"]
+    thought.pop("title", None)
+    tools = []
+    # the actions field is a list of the union of all actions
+    for action in get_args(get_args(react_model.model_fields["actions"].annotation)[0]):
+        schema = action.model_json_schema()
+        name = schema["properties"].pop("type")["const"]
+        schema.pop("title", None)
+        schema.pop("description", None)
+        schema["properties"] = {"thought": thought, **schema["properties"]}
+        # titles only repeat the field names and cost tokens on every request
+        for field in schema["properties"].values():
+            field.pop("title", None)
+        schema["required"] = ["thought"] + [field for field in schema.get("required", []) if field != "type"]
+        tools.append({
+            "type": "function",
+            "function": {"name": name, "description": action.__doc__, "parameters": schema},
+        })
+    return tools
+
+
+def react_tool_calls(calls: list[tuple[str, str]]) -> str:
+    """Turn tool calls back into the JSON of a react response, or return the arguments if they are not JSON."""
+    thoughts = []
+    actions = []
+    for name, arguments in calls:
+        try:
+            args = json.loads(arguments)
+        except ValueError:
+            return arguments
+        if not isinstance(args, dict):
+            return arguments
+        thought = args.pop("thought", "")
+        if thought and thought not in thoughts:
+            thoughts.append(thought)
+        actions.append({"type": name, **args})
+    return json.dumps({"thought": " ".join(thoughts), "actions": actions})
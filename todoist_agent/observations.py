@@ -0,0 +1,73 @@
+import os
+from typing import Any
+
+# the most rows a single observation may hold; larger results point the agent to query_tasks
+OBSERVATION_MAX_ROWS = int(os.getenv("OBSERVATION_MAX_ROWS", 200))
+
+TASK_COLUMNS = ("task_id", "name", "project_id", "created")
+PROJECT_COLUMNS = ("project_id", "name", "is_inbox")
+
+
+def encode_tasks(tasks: list[dict[str, Any]], total: int | None = None, offset: int = 0,
+                 max_rows: int = OBSERVATION_MAX_ROWS, pageable: bool = True) -> dict[str, Any]:
+    """
+    Encode tasks as a compact table for an observation.
+
+    The column names are given once and each task becomes a row. Project names are
+    listed once in a legend keyed by project id instead of being repeated per task.
+
+    Args:
+        tasks (list): The tasks as returned by the toolkit.
+        total (int): The number of tasks matching the request (default: None, the number of tasks given).
+        offset (int): The position of the first task among all matching tasks.
+        max_rows (int): The most rows to include.
+        pageable (bool): Whether the tasks are a page of a query_tasks result, so that an offset continues them.
+
+    Returns:
+        dict: The columns, rows, project legend and paging information.
+    """
+    rows = tasks[:max_rows]
+    total = len(tasks) if total is None else total
+    table = {
+        "columns": list(TASK_COLUMNS),
+        "rows": [[task[column] for column in TASK_COLUMNS] for task in rows],
+        "projects": {task["project_id"]: task["project_name"] for task in rows},
+        "total": total,
+    }
+    if offset + len(rows) < total and pageable:
+        table["next_offset"] = offset + len(rows)
+        table["note"] = f"Showing {len(rows)} of {total} tasks. Use query_tasks with filters or an offset for more."
+    elif offset + len(rows) < total:
+        # an offset into query_tasks would not line up with these tasks, so only filters are suggested
+        table["note"] = f"Showing {len(rows)} of {total} tasks. Use query_tasks with a project_id or text filter " \
+                        "to see the rest."
+    return table
+
+
+def encode_projects(projects: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Encode projects as a compact table for an observation.
+
+    Args:
+        projects (list): The projects as returned by the toolkit.
+
+    Returns:
+        dict: The columns and rows.
+    """
+    return {
+        "columns": list(PROJECT_COLUMNS),
+        "rows": [[project[column] for column in PROJECT_COLUMNS] for project in projects],
+    }
+
+
+def decode_rows(table: dict[str, Any]) -> list[dict[str, Any]]:
+    """
+    Turn an encoded table back into one dict per row.
+
+    Args:
+        table (dict): A table made by encode_tasks or encode_projects.
+
+    Returns:
+        list: The rows as dicts keyed by column name.
+    """
+    return [dict(zip(table["columns"], row)) for row in table["rows"]]
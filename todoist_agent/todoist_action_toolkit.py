@@ -1,45 +1,158 @@
 import os
-import uuid
-from datetime import datetime
-from functools import cache
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
 from typing import Any
 
-import requests
 from dateutil import parser
 from todoist_api_python.api import Project, TodoistAPI
 
+from todoist_agent.todoist_sync import SyncCommandBatcher, TodoistSyncReplica, get_session
+
+
+class TodoistSnapshot:
+    """
+    An in-memory copy of the projects and open tasks, indexed by id and by lower-cased name.
+    """
+
+    def __init__(self, projects: list[dict[str, Any]], tasks: list[dict[str, Any]]) -> None:
+        self.projects = {project["project_id"]: project for project in projects}
+        self.tasks = {task["task_id"]: task for task in tasks}
+        self.project_ids_by_name = {project["name"].lower(): project["project_id"] for project in projects}
+        self.task_ids_by_name = defaultdict(list)
+        self.task_ids_by_project = defaultdict(set)
+        for task in tasks:
+            self.task_ids_by_name[task["name"].lower()].append(task["task_id"])
+            self.task_ids_by_project[task["project_id"]].add(task["task_id"])
+
+    @property
+    def inbox_id(self) -> str:
+        for project in self.projects.values():
+            if project["is_inbox"]:
+                return project["project_id"]
+        if "inbox" in self.project_ids_by_name:
+            return self.project_ids_by_name["inbox"]
+        raise ValueError("No inbox found")
+
+    def add_project(self, project: dict[str, Any]) -> None:
+        old = self.projects.get(project["project_id"])
+        if old is not None and self.project_ids_by_name.get(old["name"].lower()) == old["project_id"]:
+            del self.project_ids_by_name[old["name"].lower()]
+        self.projects[project["project_id"]] = project
+        self.project_ids_by_name[project["name"].lower()] = project["project_id"]
+
+    def remove_project(self, project_id: str) -> None:
+        project = self.projects.pop(project_id, None)
+        if project is not None and self.project_ids_by_name.get(project["name"].lower()) == project_id:
+            del self.project_ids_by_name[project["name"].lower()]
+
+    def add_task(self, task: dict[str, Any]) -> None:
+        self.remove_task(task["task_id"])
+        self.tasks[task["task_id"]] = task
+        self.task_ids_by_name[task["name"].lower()].append(task["task_id"])
+        self.task_ids_by_project[task["project_id"]].add(task["task_id"])
+
+    def remove_task(self, task_id: str) -> None:
+        task = self.tasks.pop(task_id, None)
+        if task is not None:
+            self.task_ids_by_name[task["name"].lower()].remove(task_id)
+            self.task_ids_by_project[task["project_id"]].discard(task_id)
+
+    def move_task(self, task_id: str, project_id: str) -> None:
+        task = self.tasks[task_id]
+        self.task_ids_by_project[task["project_id"]].discard(task_id)
+        task["project_id"] = project_id
+        self.task_ids_by_project[project_id].add(task_id)
+
+    def query_tasks(self, project_id: str | None = None, text: str | None = None,
+                    created_before: str | None = None, created_after: str | None = None) -> list[dict[str, Any]]:
+        """
+        Return the tasks matching all given filters, oldest first.
+
+        The project filter is served from the per-project index. Creation times are ISO 8601
+        UTC strings and are compared to the second.
+        """
+        if project_id is not None:
+            candidates = [self.tasks[task_id] for task_id in self.task_ids_by_project.get(project_id, ())]
+        else:
+            candidates = list(self.tasks.values())
+        if text:
+            text = text.lower()
+            candidates = [task for task in candidates if text in task["name"].lower()]
+        if created_before:
+            candidates = [task for task in candidates if task["created_at"][:19] < created_before[:19]]
+        if created_after:
+            candidates = [task for task in candidates if task["created_at"][:19] >= created_after[:19]]
+        return sorted(candidates, key=lambda task: (task["created_at"], task["task_id"]))
+
 
 class TodoistActionToolKit:
     """
     A class that provides various actions and utilities for interacting with Todoist API.
+
+    Projects and tasks are kept in a snapshot that serves all reads. It is built from
+    a local replica of the account that `refresh` keeps current with incremental Sync
+    API requests; writes made through the toolkit patch the snapshot directly. Reads
+    never sync themselves, so the caller refreshes once per observation and a batch
+    of concurrent reads shares that one delta.
     """
 
     def __init__(self, api_key: str) -> None:
-        self.api = TodoistAPI(api_key)
+        self.api = TodoistAPI(api_key, session=get_session())
+        self.replica = TodoistSyncReplica(api_key)
+        self._snapshot = None
+        self._snapshot_lock = threading.Lock()
+
+    @property
+    def snapshot(self) -> TodoistSnapshot:
+        with self._snapshot_lock:
+            if self._snapshot is None:
+                self.replica.sync()
+                self._snapshot = self._build_snapshot()
+            return self._snapshot
+
+    def refresh(self) -> None:
+        """Fetch the changes since the last sync and apply them to the snapshot."""
+        with self._snapshot_lock:
+            if self._snapshot is None:
+                return
+            changes = self.replica.sync()
+            if changes["full_sync"]:
+                self._snapshot = self._build_snapshot()
+                return
+            for project in changes["projects"]:
+                self._snapshot.add_project(_format_sync_project(project))
+            for project_id in changes["removed_projects"]:
+                self._snapshot.remove_project(project_id)
+            for item in changes["items"]:
+                self._snapshot.add_task(_format_sync_item(item))
+            for item_id in changes["removed_items"]:
+                self._snapshot.remove_task(item_id)
+
+    def _build_snapshot(self) -> TodoistSnapshot:
+        return TodoistSnapshot(
+            [_format_sync_project(project) for project in self.replica.projects.values()],
+            [_format_sync_item(item) for item in self.replica.items.values()],
+        )
 
     @property
-    @cache
     def inbox_id(self) -> str:
-        projects = self.api.get_projects()
-        for project in projects:
-            if project.name.lower() == "inbox":
-                return project.id
-        raise ValueError("No inbox found")
+        snapshot = self.snapshot
+        with self._snapshot_lock:
+            return snapshot.inbox_id
 
     @property
     def _todoist_project_id_to_project_name(self) -> dict[str, str]:
-        todoist_projects = self.api.get_projects()
-        return {project.id: project.name for project in todoist_projects}
+        return {project_id: project["name"] for project_id, project in self.snapshot.projects.items()}
 
     def get_all_projects(self) -> list[dict[str, Any]]:
         return [project for project in self._get_all_projects()]
 
     def _get_all_projects(self) -> list[dict[str, str]]:
-        results = []
-        for project in self.api.get_projects():
-            results.append(self._format_project(project))
-
-        return results
+        snapshot = self.snapshot
+        # copy under the lock, a concurrent refresh may be changing the snapshot
+        with self._snapshot_lock:
+            return [dict(project) for project in snapshot.projects.values()]
 
     def _format_project(self, project: Project) -> dict[str, str]:
         return {
@@ -48,43 +161,68 @@ class TodoistActionToolKit:
             "is_inbox": project.is_inbox_project,
         }
 
-    def get_all_tasks(self) -> list[dict[str, Any]]:
-        return [
-            task
-            for task in self._get_all_tasks()
-            if task["project_id"] != self.inbox_id
-        ]
-
-    def _get_all_tasks(self) -> list[dict[str, str]]:
-        results = []
-        for task in self.api.get_tasks():
-            results.append(
-                {
-                    "name": task.content,
-                    "task_id": task.id,
-                    "project_id": task.project_id,
-                    "created": create_human_friendly_date(task.created_at),
-                    "project_name": self._todoist_project_id_to_project_name[
-                        task.project_id
-                    ],
-                }
-            )
+    def _format_task(self, task: dict[str, str], snapshot: TodoistSnapshot) -> dict[str, str]:
+        project = snapshot.projects.get(task["project_id"])
+        return {
+            "name": task["name"],
+            "task_id": task["task_id"],
+            "project_id": task["project_id"],
+            "created": create_human_friendly_date(task["created_at"]),
+            "project_name": project["name"] if project else None,
+        }
 
-        return results
+    def get_all_tasks(self) -> list[dict[str, Any]]:
+        """Return the tasks outside the inbox, oldest first like query_tasks."""
+        snapshot = self.snapshot
+        with self._snapshot_lock:
+            inbox_id = snapshot.inbox_id
+            tasks = [task for task in snapshot.query_tasks() if task["project_id"] != inbox_id]
+        return [self._format_task(task, snapshot) for task in tasks]
 
     def get_inbox_tasks(self) -> list[dict[str, Any]]:
-        return [
-            task
-            for task in self._get_all_tasks()
-            if task["project_id"] == self.inbox_id
-        ]
+        """Return the tasks in the inbox, in the order query_tasks pages through them."""
+        snapshot = self.snapshot
+        with self._snapshot_lock:
+            tasks = snapshot.query_tasks(snapshot.inbox_id)
+        return [self._format_task(task, snapshot) for task in tasks]
+
+    def query_tasks(self, project_id: str | None = None, text: str | None = None,
+                    older_than_days: int | None = None, newer_than_days: int | None = None,
+                    limit: int = 50, offset: int = 0) -> dict[str, Any]:
+        """
+        Return one page of the open tasks matching the filters, oldest first.
+
+        Args:
+            project_id (str): Only tasks in this project.
+            text (str): Only tasks whose name contains this text, ignoring case.
+            older_than_days (int): Only tasks created more than this many days ago.
+            newer_than_days (int): Only tasks created less than this many days ago.
+            limit (int): The maximum number of tasks to return.
+            offset (int): The number of matching tasks to skip.
+
+        Returns:
+            dict: The number of matching tasks as "total" and the page of tasks as "tasks".
+        """
+        if project_id is not None:
+            _ = self._get_project(project_id)
+        now = datetime.now(timezone.utc)
+        created_before = (now - timedelta(days=older_than_days)).isoformat() if older_than_days is not None else None
+        created_after = (now - timedelta(days=newer_than_days)).isoformat() if newer_than_days is not None else None
+
+        snapshot = self.snapshot
+        with self._snapshot_lock:
+            matches = snapshot.query_tasks(project_id, text, created_before, created_after)
+        return {
+            "total": len(matches),
+            "tasks": [self._format_task(task, snapshot) for task in matches[offset:offset + limit]],
+        }
 
     def create_project(self, name: str) -> dict[str, Any]:
-        for project in self.api.get_projects():
-            if project.name.lower() == name.lower():
-                raise ValueError(f"Project {name} already exists.")
-        project = self.api.add_project(name)
-        return self._format_project(project)
+        if name.lower() in self.snapshot.project_ids_by_name:
+            raise ValueError(f"Project {name} already exists.")
+        project = self._format_project(self.api.add_project(name))
+        self.snapshot.add_project(project)
+        return project
 
     def move_task(self, task_id: str, project_id: str) -> None:
         task = self._get_task(task_id)
@@ -95,21 +233,68 @@ class TodoistActionToolKit:
                 f"Task {task_id} is already in project {project_id}. No need to move it." # noqa
             )
 
-        return _move_task_api_call(task_id, project_id)
+        result = _move_task_api_call(task_id, project_id, self.replica.api_key)
+        self.snapshot.move_task(task_id, project_id)
+        return result
+
+    def move_tasks(self, task_ids: list[str], project_id: str) -> list[dict[str, str]]:
+        """Move several tasks to one project with a single batched request, reporting the result per task."""
+        _ = self._get_project(project_id)
+
+        results = {}
+        batcher = SyncCommandBatcher(self.replica.api_key)
+        command_ids = {}
+        for task_id in task_ids:
+            try:
+                task = self._get_task(task_id)
+            except ValueError as e:
+                results[task_id] = str(e)
+                continue
+            if task["project_id"] == project_id:
+                results[task_id] = f"Task {task_id} is already in project {project_id}."
+                continue
+            command_ids[task_id] = batcher.add("item_move", {"id": task_id, "project_id": project_id})
+
+        sync_status = batcher.flush()["sync_status"] if command_ids else {}
+        for task_id, command_id in command_ids.items():
+            status = sync_status.get(command_id)
+            if status == "ok":
+                self.snapshot.move_task(task_id, project_id)
+                results[task_id] = "moved"
+            else:
+                results[task_id] = f"Error: {status}"
+
+        return [{"task_id": task_id, "result": results[task_id]} for task_id in task_ids]
 
     def _get_task(self, task_id) -> dict[str, str]:
-        for task in self._get_all_tasks():
-            if task["task_id"] == task_id:
-                return task
+        snapshot = self.snapshot
+        if task_id in snapshot.tasks:
+            return self._format_task(snapshot.tasks[task_id], snapshot)
         raise ValueError(f"Task {task_id} does not exist.")
 
     def _get_project(self, project_id) -> dict[str, str]:
-        for project in self._get_all_projects():
-            if project["project_id"] == project_id:
-                return project
+        if project_id in self.snapshot.projects:
+            return dict(self.snapshot.projects[project_id])
         raise ValueError(f"Project {project_id} does not exist.")
 
 
+def _format_sync_project(project: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "name": project["name"],
+        "project_id": project["id"],
+        "is_inbox": bool(project.get("inbox_project")),
+    }
+
+
+def _format_sync_item(item: dict[str, Any]) -> dict[str, str]:
+    return {
+        "name": item["content"],
+        "task_id": item["id"],
+        "project_id": item["project_id"],
+        "created_at": item["added_at"],
+    }
+
+
 def create_human_friendly_date(date: str) -> str:
     input_datetime = parser.isoparse(date)
     now = datetime.utcnow().replace(tzinfo=input_datetime.tzinfo)
@@ -125,24 +310,13 @@ def create_human_friendly_date(date: str) -> str:
     return "Just now"
 
 
-def _move_task_api_call(task_id: str, project_id: str):
-    body = {
-        "commands": [
-            {
-                "type": "item_move",
-                "args": {"id": task_id, "project_id": project_id},
-                "uuid": uuid.uuid4().hex,
-            },
-        ],
-    }
-    response = requests.post(
-        "https://api.todoist.com/sync/v9/sync",
-        headers={"Authorization": f"Bearer {os.getenv('TODOIST_API_KEY')}"},
-        json=body,
-    )
-    if response.status_code >= 400:
+def _move_task_api_call(task_id: str, project_id: str, api_key: str | None = None):
+    batcher = SyncCommandBatcher(api_key or os.getenv('TODOIST_API_KEY'))
+    command_id = batcher.add("item_move", {"id": task_id, "project_id": project_id})
+    result = batcher.flush()
+    if result["sync_status"].get(command_id) != "ok":
         raise ValueError(
-            f"Error failed to move task {task_id} to project {project_id}. Error: {response.text}" # noqa
+            f"Error failed to move task {task_id} to project {project_id}. Error: {result['sync_status'].get(command_id)}" # noqa
         )
 
-    return response.json()
+    return result
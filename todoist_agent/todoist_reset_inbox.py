@@ -1,35 +1,110 @@
 #!/usr/bin/env python
+import argparse
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import requests
 from dotenv import load_dotenv
 from todoist_api_python.api import Project, TodoistAPI
+from tqdm import tqdm
 
-from todoist_action_toolkit import _move_task_api_call
+from todoist_agent.todoist_sync import SYNC_COMMANDS_PER_REQUEST, SyncCommandBatcher, get_session
+
+DELETE_WORKERS = 8
 
 
 def main() -> None:
-    """Simple script that move all tasks to inbox and delete all projects except inbox"""  # noqa: E501
+    """Simple script that move all tasks to inbox and delete all projects except inbox.
+
+    Run it from the repository root with `python -m todoist_agent.todoist_reset_inbox`.
+    """  # noqa: E501
 
+    args = parse_args()
     load_dotenv()
-    todoist = TodoistAPI(os.getenv("TODOIST_API_KEY"))
+    api_key = os.getenv("TODOIST_API_KEY")
+    todoist = TodoistAPI(api_key, session=get_session())
 
-    inbox_project = get_inbox_project(todoist)
+    projects = todoist.get_projects()
+    inbox_project = get_inbox_project(projects)
 
-    for task in todoist.get_tasks():
-        _move_task_api_call(task.id, inbox_project.id)
+    tasks = [task for task in todoist.get_tasks() if task.project_id != inbox_project.id]
+    # deleting a project also deletes its sub-projects, so only the top-most ones are deleted
+    doomed = {project.id: project for project in projects if project.id != inbox_project.id}
+    roots = [project for project in doomed.values() if project.parent_id not in doomed]
 
-    for project in todoist.get_projects():
-        if project.name.lower() != "inbox":
-            todoist.delete_project(project.id)
+    move_requests = -(-len(tasks) // args.batch_size)
+    print(f"Plan: {len(tasks)} item_move commands in {move_requests} sync requests, "
+          f"then {len(roots)} project deletions ({len(doomed)} projects including sub-projects).")
+    if args.dry_run:
+        return
 
+    move_tasks_to_inbox(api_key, tasks, inbox_project.id, args.batch_size)
+    delete_projects(todoist, roots, args.workers)
 
-def get_inbox_project(todoist) -> Project:
-    projects = todoist.get_projects()
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Move all tasks to the inbox and delete all other projects.")
+    parser.add_argument("--dry-run", action="store_true", help="only report the planned commands")
+    parser.add_argument("--batch-size", type=int, default=SYNC_COMMANDS_PER_REQUEST,
+                        help="move commands per sync request")
+    parser.add_argument("--workers", type=int, default=DELETE_WORKERS, help="concurrent project deletions")
+    return parser.parse_args()
+
+
+def move_tasks_to_inbox(api_key: str, tasks: list, inbox_id: str, batch_size: int) -> None:
+    batcher = SyncCommandBatcher(api_key, batch_size)
+    for task in tasks:
+        batcher.add("item_move", {"id": task.id, "project_id": inbox_id})
+
+    start = time.perf_counter()
+    with tqdm(total=len(tasks), desc="Moving tasks", unit="task") as progress:
+        result = batcher.flush(on_progress=progress.update)
+    failed = [status for status in result["sync_status"].values() if status != "ok"]
+    _report("Moved", len(tasks) - len(failed), start, failed)
+
+
+def delete_projects(todoist: TodoistAPI, projects: list[Project], workers: int) -> None:
+    start = time.perf_counter()
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            tqdm(total=len(projects), desc="Deleting projects", unit="project") as progress:
+        futures = {executor.submit(delete_project, todoist, project): project for project in projects}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except requests.HTTPError as e:
+                failed.append(f"{futures[future].name}: {e}")
+            progress.update(1)
+    _report("Deleted", len(projects) - len(failed), start, failed)
+
+
+def delete_project(todoist: TodoistAPI, project: Project) -> None:
+    """
+    Delete a project. Projects that are already gone count as deleted.
+
+    The shared session waits out rate limits, so a 429 only surfaces once its retries are used up.
+    """
+    try:
+        todoist.delete_project(project.id)
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+
+
+def get_inbox_project(projects: list[Project]) -> Project:
     for project in projects:
         if project.name.lower() == "inbox":
             return project
     raise ValueError("No inbox found")
 
 
+def _report(action: str, count: int, start: float, failed: list) -> None:
+    elapsed = time.perf_counter() - start
+    print(f"{action} {count} in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.1f}/s).")
+    for failure in failed:
+        print(f"  failed: {failure}")
+
+
 if __name__ == "__main__":
     main()
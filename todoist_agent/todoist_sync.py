@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import get_instrumentation, http_span_name
+from rate_limiter import get_rate_limiter
+
+TODOIST_SYNC_URL = os.getenv("TODOIST_SYNC_URL", "https://api.todoist.com/sync/v9/sync")
+TODOIST_REPLICA_DIR = os.getenv("TODOIST_REPLICA_DIR", "logs/todoist_replica")
+TODOIST_POOL_SIZE = int(os.getenv("TODOIST_POOL_SIZE", 20))
+# the Sync API accepts at most 100 commands per request
+SYNC_COMMANDS_PER_REQUEST = 100
+
+PROJECT_FIELDS = ("id", "name", "inbox_project")
+ITEM_FIELDS = ("id", "content", "project_id", "added_at")
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Return the process-wide session used for all Todoist HTTP calls.
+
+    Requests are scheduled by the rate limiter of their API key and retried when rate limited.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = RateLimitedAdapter(pool_connections=TODOIST_POOL_SIZE, pool_maxsize=TODOIST_POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _session.hooks["response"].append(_record_span)
+        return _session
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    An adapter that sends each request through the rate limiter of its API key.
+
+    Requests wait in the limiter's priority queue, and a 429 pauses every request of the
+    key for the Retry-After delay or a jittered exponential backoff before it is retried.
+    """
+
+    def send(self, request, **kwargs):
+        limiter = get_rate_limiter("todoist", request.headers.get("Authorization"))
+        for attempt in range(limiter.max_retries + 1):
+            limiter.acquire()
+            response = super().send(request, **kwargs)
+            limiter.update_from_headers(response.headers)
+            if response.status_code != 429 or attempt == limiter.max_retries:
+                return response
+            response.close()
+            limiter.on_rate_limited(response.headers, attempt)
+        return response
+
+
+def _record_span(response: requests.Response, *args, **kwargs) -> None:
+    # streamed bodies are left unread; their size comes from the header if at all
+    size = int(response.headers.get("Content-Length", 0)) if kwargs.get("stream") else len(response.content)
+    get_instrumentation().record({
+        "kind": "todoist_http",
+        "name": http_span_name(response.request.method, response.request.url),
+        "status": response.status_code,
+        "bytes": size,
+        "error": response.status_code >= 400,
+    }, response.elapsed.total_seconds())
+
+
+class TodoistSyncReplica:
+    """
+    A local copy of the projects and open items of a Todoist account.
+
+    The first sync downloads everything; later syncs send the stored sync token and
+    only receive what changed. The replica is persisted to disk, so a new agent run
+    starts with a delta request instead of a full download.
+    """
+
+    def __init__(self, api_key: str, replica_dir: str = TODOIST_REPLICA_DIR) -> None:
+        self.api_key = api_key
+        account = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        self.path = Path(replica_dir) / f"{account}.json"
+        self.sync_token = "*"
+        self.projects: dict[str, dict[str, Any]] = {}
+        self.items: dict[str, dict[str, Any]] = {}
+        self._load()
+
+    def sync(self) -> dict[str, Any]:
+        """
+        Fetch the changes since the last sync and merge them into the replica.
+
+        Returns:
+            dict: Whether this was a full sync, the projects and items that were added
+            or updated, and the ids of those that were removed.
+        """
+        response = get_session().post(
+            TODOIST_SYNC_URL,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            data={"sync_token": self.sync_token, "resource_types": json.dumps(["projects", "items"])},
+        )
+        if response.status_code >= 400:
+            raise ValueError(f"Error failed to sync with Todoist. Error: {response.text}")
+        data = response.json()
+
+        full_sync = data.get("full_sync", False)
+        if full_sync:
+            self.projects.clear()
+            self.items.clear()
+
+        changes = {
+            "full_sync": full_sync,
+            "projects": [],
+            "removed_projects": [],
+            "items": [],
+            "removed_items": [],
+        }
+        for project in data.get("projects", []):
+            if project.get("is_deleted") or project.get("is_archived"):
+                if self.projects.pop(project["id"], None) is not None:
+                    changes["removed_projects"].append(project["id"])
+            else:
+                self.projects[project["id"]] = _pick(project, PROJECT_FIELDS)
+                changes["projects"].append(self.projects[project["id"]])
+        for item in data.get("items", []):
+            if item.get("is_deleted") or item.get("checked"):
+                if self.items.pop(item["id"], None) is not None:
+                    changes["removed_items"].append(item["id"])
+            else:
+                self.items[item["id"]] = _pick(item, ITEM_FIELDS)
+                changes["items"].append(self.items[item["id"]])
+
+        self.sync_token = data.get("sync_token", self.sync_token)
+        # an empty delta is not written; the stored older token still yields every later change
+        if full_sync or any(changes[key] for key in changes if key != "full_sync"):
+            self._save()
+        return changes
+
+    def _load(self) -> None:
+        try:
+            state = json.loads(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            return
+        self.sync_token = state["sync_token"]
+        self.projects = state["projects"]
+        self.items = state["items"]
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first so a crash never leaves a truncated replica
+        tmp_path = self.path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps({
+            "sync_token": self.sync_token,
+            "projects": self.projects,
+            "items": self.items,
+        }))
+        os.replace(tmp_path, self.path)
+
+
+class SyncCommandBatcher:
+    """
+    Collects Sync API write commands and sends them in as few requests as possible.
+
+    Each command gets its own uuid, and `flush` reports the outcome per command.
+    """
+
+    def __init__(self, api_key: str, batch_size: int = SYNC_COMMANDS_PER_REQUEST) -> None:
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.commands: list[dict[str, Any]] = []
+
+    def add(self, command_type: str, args: dict[str, Any], temp_id: str | None = None) -> str:
+        """
+        Queue a command.
+
+        Args:
+            command_type (str): The Sync API command, e.g. "item_move".
+            args (dict): The command arguments.
+            temp_id (str): A temporary id for commands that create a resource.
+
+        Returns:
+            str: The uuid identifying the command in the results.
+        """
+        command = {"type": command_type, "args": args, "uuid": uuid.uuid4().hex}
+        if temp_id is not None:
+            command["temp_id"] = temp_id
+        self.commands.append(command)
+        return command["uuid"]
+
+    def flush(self, on_progress: Callable[[int], None] | None = None) -> dict[str, Any]:
+        """
+        Send the queued commands in chunks of `batch_size`.
+
+        Args:
+            on_progress (callable): Called with the number of commands after each chunk is sent.
+
+        Returns:
+            dict: "sync_status" maps each command uuid to "ok" or the error returned for it,
+            and "temp_id_mapping" maps temporary ids to the ids of the created resources.
+
+        Raises:
+            ValueError: If a request fails as a whole.
+        """
+        results: dict[str, Any] = {"sync_status": {}, "temp_id_mapping": {}}
+        commands, self.commands = self.commands, []
+        for start in range(0, len(commands), self.batch_size):
+            chunk = commands[start:start + self.batch_size]
+            response = get_session().post(
+                TODOIST_SYNC_URL,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                json={"commands": chunk},
+            )
+            if response.status_code >= 400:
+                raise ValueError(f"Error failed to send {len(chunk)} Todoist commands. Error: {response.text}")
+            data = response.json()
+            results["sync_status"].update(data.get("sync_status", {}))
+            results["temp_id_mapping"].update(data.get("temp_id_mapping", {}))
+            if on_progress:
+                on_progress(len(chunk))
+        return results
+
+
+def _pick(resource: dict[str, Any], fields: tuple[str, ...]) -> dict[str, Any]:
+    return {field: resource.get(field) for field in fields}
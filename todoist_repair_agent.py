@@ -1,6 +1,26 @@
 import os
+import re
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+
+import dirtyjson
 import pydantic
 from chatbot import ChatBot
+from instrumentation import get_instrumentation
+from logger import get_logger
+from response_cache import ResponseCache, get_response_cache
+
+log = get_logger(__name__)
+
+FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+# "cached" is an LLM repair of the same input replayed from the response cache
+REPAIR_TIERS = ("strict", "fences", "extract", "lenient", "cached", "llm")
+
+# how often each tier produced the valid model, across the process
+repair_tier_hits = Counter()
+_hits_lock = threading.Lock()
 
 
 SYSTEM_PROMPT = \
@@ -11,15 +31,20 @@ SYSTEM_PROMPT = \
 
 
 def parse_base_model_with_retries(
-    raw_response: str, base_model: pydantic.BaseModel, retries: int = 3
+    raw_response: str, base_model: pydantic.BaseModel, retries: int = 3, chatbot: ChatBot | None = None
 ) -> pydantic.BaseModel:
     """
     Parses the raw response using the specified base model with retries.
 
+    Cheap local repairs are tried first: stripping markdown fences, extracting the first
+    balanced JSON object and parsing it leniently (single quotes, trailing commas). The
+    LLM is only asked to fix the input when all of them fail.
+
     Args:
         raw_response (str): The raw response to parse.
         base_model (pydantic.BaseModel): The base model to use for parsing.
-        retries (int, optional): The number of retries to attempt. Defaults to 3.
+        retries (int, optional): The number of LLM repairs to attempt. Defaults to 3.
+        chatbot (ChatBot, optional): The chatbot used for repairs. Defaults to a new one using OPENAI_API_KEY.
 
     Returns:
         pydantic.BaseModel: The parsed base model.
@@ -27,27 +52,144 @@ def parse_base_model_with_retries(
     Raises:
         ValueError: If the parsing fails after the specified number of retries.
     """
+    with get_instrumentation().span("repair", base_model.__name__, bytes=len(raw_response)) as span:
+        return _parse_with_retries(raw_response, base_model, retries, chatbot, span)
 
-    openai_api_key = os.getenv('OPENAI_API_KEY', None)
-    chatbot = ChatBot(openai_api_key)
-    chatbot.set_system_prompt(None, SYSTEM_PROMPT)
 
-    updated_input_str = raw_response
+def _parse_with_retries(raw_response, base_model, retries, chatbot, span):
+    span["llm_attempts"] = 0
+    try:
+        parsed, tier = repair_locally(raw_response, base_model)
+    except ValueError as exception:
+        error = exception
+    else:
+        span["tier"] = tier
+        _record_hit(tier)
+        return parsed
 
-    for _ in range(retries):
+    if chatbot is None:
+        # the ChatBot is cheap to build, its OpenAI client is shared process-wide
+        openai_api_key = os.getenv('OPENAI_API_KEY', None)
+        chatbot = ChatBot(openai_api_key, response_cache=get_response_cache())
+    # a repair is cached per faulty input, and only once it validated; the lookup is not one of the retries
+    cache = chatbot.response_cache
+    cache_key = ResponseCache.key("repair", [base_model.__name__, raw_response], 0)
+    cached = cache.get(cache_key) if cache is not None else None
+    if cached is not None:
         try:
-            return base_model.parse_raw(updated_input_str)
-        except Exception as exception:
-            updated_input_str = chatbot.send(
-                    "assistant", _format_fix_prompt(updated_input_str, base_model, exception), 0.70, 15
-            )
-            print(f"Could not parse input.\nOriginal: {raw_response}\nTry to update the input to: {updated_input_str}") # noqa
+            parsed, _ = repair_locally(cached, base_model)
+        except ValueError:
+            # a stale entry, e.g. from before the model changed; repair from scratch
+            log.debug(f"Ignoring a cached repair that no longer validates for {base_model.__name__}")
+        else:
+            span["cached"] = True
+            span["tier"] = "cached"
+            _record_hit("cached")
+            return parsed
+
+    chatbot.set_system_prompt(None, SYSTEM_PROMPT)
+    chatbot.reset_history()
+    updated_input_str = raw_response
+    start = time.perf_counter()
+    for attempt in range(1, retries + 1):
+        span["llm_attempts"] = attempt
+        updated_input_str = chatbot.send(
+                "assistant", _format_fix_prompt(updated_input_str, base_model, error), 0.70, 15, cache=False
+        )
+        log.debug(f"Could not parse input.\nOriginal: {raw_response}\nTry to update the input to: {updated_input_str}")  # noqa
+        try:
+            parsed, _ = repair_locally(updated_input_str, base_model)
+        except ValueError as exception:
+            error = exception
+            continue
+        span["tier"] = "llm"
+        _record_hit("llm")
+        if cache is not None:
+            cache.put(cache_key, updated_input_str, time.perf_counter() - start)
+        return parsed
 
     raise ValueError(
         f"Failed to repair with retries.\nOriginal input: {raw_response}\nTry to update the input to: {updated_input_str}" # noqa
     )
 
 
+def repair_locally(raw_response: str, base_model: pydantic.BaseModel) -> tuple[pydantic.BaseModel, str]:
+    """
+    Parses the raw response with the local repair tiers, cheapest first.
+
+    Args:
+        raw_response (str): The raw response to parse.
+        base_model (pydantic.BaseModel): The base model to use for parsing.
+
+    Returns:
+        tuple: The parsed base model and the name of the tier that produced it.
+
+    Raises:
+        ValueError: The validation error of the last candidate if no tier succeeds.
+    """
+    validator = _validator(base_model)
+    error = None
+
+    fenced = FENCE_RE.search(raw_response)
+    candidates = [("strict", raw_response)]
+    if fenced:
+        candidates.append(("fences", fenced.group(1)))
+    candidates += [("extract", obj) for obj in _json_objects(raw_response)]
+    for tier, candidate in candidates:
+        try:
+            return validator.validate_json(candidate), tier
+        except ValueError as e:
+            error = e
+
+    for _, candidate in candidates[1:] or candidates:
+        try:
+            return validator.validate_python(dirtyjson.loads(candidate)), "lenient"
+        except (ValueError, dirtyjson.Error) as e:
+            error = e
+
+    raise ValueError(str(error))
+
+
+def repair_stats() -> dict[str, float]:
+    """
+    Returns how often each repair tier produced the valid model.
+
+    Returns:
+        dict: The hits per tier and the share of parses that needed the LLM.
+    """
+    with _hits_lock:
+        hits = {tier: repair_tier_hits[tier] for tier in REPAIR_TIERS}
+    total = sum(hits.values())
+    return {**hits, "llm_ratio": hits["llm"] / total if total else 0.0}
+
+
+@lru_cache(maxsize=None)
+def _validator(base_model: pydantic.BaseModel) -> pydantic.TypeAdapter:
+    return pydantic.TypeAdapter(base_model)
+
+
+@lru_cache(maxsize=None)
+def _schema(base_model: pydantic.BaseModel) -> str:
+    return str(base_model.model_json_schema())
+
+
+def _json_objects(text: str) -> list[str]:
+    scanner = JsonObjectScanner()
+    objects = []
+    obj = scanner.feed(text)
+    while obj is not None:
+        objects.append(obj)
+        obj = scanner.feed("")
+    return objects
+
+
+def _record_hit(tier: str) -> None:
+    with _hits_lock:
+        repair_tier_hits[tier] += 1
+    if tier != "strict":
+        log.info(f"Repaired a malformed response with the {tier} tier. Tier hits: {repair_stats()}")
+
+
 def _format_fix_prompt(
     updated_input_str: str,
     base_model: pydantic.BaseModel,
@@ -67,7 +209,7 @@ def _format_fix_prompt(
     """
     return f'''
 JSON_SCHEMA:
-{base_model.schema()}
+{_schema(base_model)}
 
 FAULTY_INPUT:
 {updated_input_str}
@@ -75,3 +217,57 @@ FAULTY_INPUT:
 ERROR_MSG:
 {exception}
 FIXED_INPUT:'''.strip()
+
+
+class JsonObjectScanner:
+    """
+    Finds the end of the first top-level JSON object in text that arrives in pieces.
+
+    Braces inside strings are ignored, so the object can be validated as soon as its
+    closing brace arrives instead of waiting for the end of the response.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._start = None
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, delta: str) -> str | None:
+        """
+        Scans the next piece of text.
+
+        Args:
+            delta (str): The text received since the last call.
+
+        Returns:
+            str: The next complete top-level JSON object, or None if none has closed yet.
+        """
+        self.text += delta
+        while self._pos < len(self.text):
+            i = self._pos
+            char = self.text[i]
+            self._pos += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self._start is not None:
+                self._in_string = True
+            elif char == "{":
+                if self._start is None:
+                    self._start = i
+                self._depth += 1
+            elif char == "}" and self._start is not None:
+                self._depth -= 1
+                if self._depth == 0:
+                    obj = self.text[self._start:i + 1]
+                    # keep scanning for the next object if this one is rejected
+                    self._start = None
+                    return obj
+        return None
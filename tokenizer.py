@@ -0,0 +1,35 @@
+from functools import lru_cache
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model):
+    # tiktoken is only imported once something is counted, not when the app starts
+    import tiktoken
+    try:
+        try:
+            return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(DEFAULT_ENCODING)
+        except KeyError:
+            # models newer than the installed tiktoken fall back to the default encoding
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception:
+        # the encoding files could not be loaded (e.g. offline); use the estimate instead
+        return None
+
+
+def count_tokens(text, model=None) -> int:
+    '''
+    Counts the tokens in a piece of text locally.
+
+    Args:
+        text (str): The text to count.
+        model (str): The model whose encoding to use (default: None, the cl100k_base encoding).
+
+    Returns:
+        int: The number of tokens, or an estimate of four characters per token if no encoding is available.
+    '''
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))